@@ -1,5 +1,17 @@
+import argparse
+import array
+import math
 import random
 import os
+import struct
+
+# Binary dataset layout: magic, format version, key typecode (padded to 4 bytes) and key
+# count, followed by the raw keys. benchmark.load_dataset reads the same layout.
+DATASET_MAGIC = b"AVLKEYS\0"
+DATASET_VERSION = 1
+DATASET_HEADER = struct.Struct("<8sI4sQ")
+
+CHUNK_SIZE = 1 << 16
 
 def generate_datasets():
     sizes = {"small": 5, "medium": 15, "large": 30}
@@ -19,5 +31,177 @@ def generate_datasets():
         with open(f"datasets/dataset_{name}.txt", "w") as f:
             f.write("\n".join(map(str, dataset)))
 
+def uniform_keys(rng, size, key_space):
+    """
+    Independent keys drawn uniformly from [0, key_space).
+    """
+    for _ in range(size):
+        yield rng.randrange(key_space)
+
+def _spread_step(size, key_space):
+    # Gap between `size` distinct keys spread evenly over [0, key_space)
+    if size > key_space:
+        raise ValueError(f"Cannot draw {size} distinct keys from a key space of {key_space}")
+    return max(key_space // max(size, 1), 1)
+
+def sorted_keys(rng, size, key_space):
+    """
+    Distinct keys in ascending order, spread evenly over [0, key_space).
+    """
+    step = _spread_step(size, key_space)
+    return (i * step for i in range(size))
+
+def reverse_keys(rng, size, key_space):
+    """
+    Distinct keys in descending order, spread evenly over [0, key_space).
+    """
+    step = _spread_step(size, key_space)
+    return (i * step for i in range(size - 1, -1, -1))
+
+def zipf_keys(rng, size, key_space, exponent=1.1):
+    """
+    Keys in [0, key_space) with P(k) proportional to 1 / (k + 1)**exponent, sampled by
+    rejection-inversion (Hoermann and Derflinger), so no table of key_space weights
+    is ever built. Small keys are the hot ones.
+    """
+    def helper1(x):
+        return math.log1p(x) / x if abs(x) > 1e-8 else 1 - x * (0.5 - x * (1 / 3 - 0.25 * x))
+
+    def helper2(x):
+        return math.expm1(x) / x if abs(x) > 1e-8 else 1 + x * 0.5 * (1 + x / 3 * (1 + 0.25 * x))
+
+    def h(x):
+        return math.exp(-exponent * math.log(x))
+
+    def h_integral(x):
+        log_x = math.log(x)
+        return helper2((1 - exponent) * log_x) * log_x
+
+    def h_integral_inverse(x):
+        t = max(x * (1 - exponent), -1.0)
+        return math.exp(helper1(t) * x)
+
+    h_integral_x1 = h_integral(1.5) - 1
+    h_integral_n = h_integral(key_space + 0.5)
+    s = 2 - h_integral_inverse(h_integral(2.5) - h(2))
+
+    for _ in range(size):
+        while True:
+            u = h_integral_n + rng.random() * (h_integral_x1 - h_integral_n)
+            x = h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), key_space)
+            if k - x <= s or u >= h_integral(k + 0.5) - h(k):
+                # The sampler works on ranks 1..key_space
+                yield k - 1
+                break
+
+def clustered_keys(rng, size, key_space, clusters=16, spread=None):
+    """
+    Keys packed around a few random cluster centres with a normal spread.
+    """
+    spread = spread or max(key_space // (clusters * 100), 1)
+    centers = [rng.randrange(key_space) for _ in range(clusters)]
+    for _ in range(size):
+        key = int(rng.gauss(rng.choice(centers), spread))
+        yield min(max(key, 0), key_space - 1)
+
+def duplicate_keys(rng, size, key_space, distinct=None):
+    """
+    Keys drawn uniformly from a small pool of distinct values, one per hundred keys
+    by default, so every value repeats many times.
+    """
+    distinct = distinct or max(size // 100, 1)
+    step = max(key_space // distinct, 1)
+    for _ in range(size):
+        yield rng.randrange(distinct) * step
+
+def avl_worst_keys(rng, size, key_space):
+    """
+    Level order of a Fibonacci tree: every prefix is itself a valid AVL tree, so no
+    rotation ever fires and the result is the tallest possible AVL tree (about
+    1.44 * log2(n) levels). Keys left over after the largest Fibonacci tree that fits
+    are appended in ascending order. The keys are 0..size - 1, whatever the key space.
+    Levels are produced by depth-limited walks, so memory stays O(height).
+    """
+    # min_nodes[h] is the node count of a Fibonacci tree of height h
+    min_nodes = [0, 1]
+    while min_nodes[-1] + min_nodes[-2] + 1 <= size:
+        min_nodes.append(min_nodes[-1] + min_nodes[-2] + 1)
+    height = len(min_nodes) - 1 if size else 0
+
+    for depth in range(height):
+        stack = [(0, height, 0)]
+        while stack:
+            offset, node_height, node_depth = stack.pop()
+            if node_height <= 0:
+                continue
+            left_height = node_height - 1
+            right_height = node_height - 2
+            key = offset + min_nodes[left_height]
+            if node_depth == depth:
+                yield key
+                continue
+            # Push right first so the left subtree is walked first
+            stack.append((key + 1, right_height, node_depth + 1))
+            stack.append((offset, left_height, node_depth + 1))
+
+    yield from range(min_nodes[height], size)
+
+GENERATORS = {
+    "uniform": uniform_keys,
+    "sorted": sorted_keys,
+    "reverse": reverse_keys,
+    "zipf": zipf_keys,
+    "clustered": clustered_keys,
+    "duplicates": duplicate_keys,
+    "avl_worst": avl_worst_keys,
+}
+
+# Distributions of distinct keys, which need at least as many keys in the key space
+DISTINCT_DISTRIBUTIONS = {"sorted", "reverse", "avl_worst"}
+
+def write_dataset(path, size, distribution="uniform", seed=0, key_space=None, typecode="q", binary=True):
+    """
+    Stream `size` keys of the given distribution to `path` in chunks, so even 10**8 keys
+    never sit in memory at once. The same seed always produces the same file.
+    """
+    rng = random.Random(seed)
+    key_space = key_space or max(size * 10, 1)
+    if distribution in DISTINCT_DISTRIBUTIONS and size > key_space:
+        raise ValueError(f"Cannot draw {size} distinct keys from a key space of {key_space}")
+    keys = GENERATORS[distribution](rng, size, key_space)
+
+    with open(path, "wb" if binary else "w") as f:
+        if binary:
+            f.write(DATASET_HEADER.pack(DATASET_MAGIC, DATASET_VERSION, typecode.encode("ascii"), size))
+        while True:
+            chunk = array.array(typecode, (key for _, key in zip(range(CHUNK_SIZE), keys)))
+            if not chunk:
+                break
+            if binary:
+                chunk.tofile(f)
+            else:
+                f.write("\n".join(map(str, chunk)))
+                f.write("\n")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate benchmark datasets. Without --size the three small text datasets are written.")
+    parser.add_argument("--size", type=int, help="number of keys to generate")
+    parser.add_argument("--distribution", choices=list(GENERATORS), default="uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--key-space", type=int, default=None, help="keys fall in [0, key-space), default 10 * size")
+    parser.add_argument("--typecode", default="q", help="array typecode of the stored keys")
+    parser.add_argument("--text", action="store_true", help="write one key per line instead of binary")
+    parser.add_argument("--output", help="output file (default datasets/dataset_<distribution>_<size>.bin)")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    generate_datasets()
+    args = parse_args()
+    if args.size is None:
+        generate_datasets()
+    else:
+        extension = "txt" if args.text else "bin"
+        output = args.output or os.path.join("datasets", f"dataset_{args.distribution}_{args.size}.{extension}")
+        write_dataset(output, args.size, args.distribution, args.seed, args.key_space, args.typecode, not args.text)
+        print(f"Wrote {args.size} {args.distribution} keys to {output}")
@@ -1,125 +1,303 @@
+import argparse
+import csv
+import gzip
+import json
+import math
+import random
+import sys
 import matplotlib.pyplot as plt
 import os
 
-def load_results(file_path):
+OPERATIONS = ["insert", "search", "delete"]
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "result", "benchmark_results.jsonl")
+
+class RunningStats:
     """
-    Load benchmark results from a custom text file format.
+    Count, mean, variance, min and max of a stream of samples, updated in O(1) memory
+    with Welford's method, plus a uniform reservoir of at most `reservoir_size` samples
+    for percentiles.
     """
-    results = {}
-    with open(file_path, "r") as f:
-        lines = f.readlines()
+    def __init__(self, reservoir_size=1024):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.reservoir = []
+        self.reservoir_size = reservoir_size
+        self.rng = random.Random(0)
 
-    current_tree_type = None
-    current_dataset = None
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
 
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
+        # Algorithm R: every sample seen so far stays in the reservoir with equal probability
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append(value)
+        else:
+            slot = self.rng.randrange(self.count)
+            if slot < self.reservoir_size:
+                self.reservoir[slot] = value
 
-        if " - Dataset: " in line:
-            current_tree_type, current_dataset = line.split(" - Dataset: ")
-            current_dataset = current_dataset.strip()
-            if current_tree_type not in results:
-                results[current_tree_type] = {}
-            results[current_tree_type][current_dataset] = {}
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
 
-        elif line.endswith("Operation:"):
-            operation = line.replace("Operation:", "").strip().lower()
-            results[current_tree_type][current_dataset][operation] = {"times": [], "memory": []}
+    def stdev(self):
+        return math.sqrt(self.variance())
 
-        elif line.startswith("Times:"):
-            times = list(map(float, line.replace("Times:", "").strip(" []\n").split(", ")))
-            results[current_tree_type][current_dataset][operation]["times"] = times
+    def percentile(self, percent):
+        """
+        Linearly interpolated percentile of the reservoir (exact while count <= reservoir_size).
+        """
+        samples = sorted(self.reservoir)
+        if not samples:
+            return math.nan
+        position = (len(samples) - 1) * percent / 100
+        lower = int(position)
+        upper = min(lower + 1, len(samples) - 1)
+        return samples[lower] + (samples[upper] - samples[lower]) * (position - lower)
 
-        elif line.startswith("Memory Usage:"):
-            memory = list(map(float, line.replace("Memory Usage:", "").strip(" []\n").split(", ")))
-            results[current_tree_type][current_dataset][operation]["memory"] = memory
+def iter_records(file_path):
+    """
+    Lazily yield the records of a results file written by benchmark.py: JSON Lines, or
+    CSV if the name ends in .csv, either of them optionally gzip-compressed.
+    """
+    if file_path.endswith(".gz"):
+        f = gzip.open(file_path, "rt", newline="")
+    else:
+        f = open(file_path, "r", newline="")
+    with f:
+        if file_path.endswith((".csv", ".csv.gz")):
+            for record in csv.DictReader(f):
+                record["size"] = int(record["size"])
+                record["repetition"] = int(record["repetition"])
+                record["value"] = float(record["value"])
+                yield record
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
 
+def load_results(file_path):
+    """
+    Stream benchmark records into aggregates, so the file is never held in memory:
+    results[engine][dataset][operation] holds the dataset "size" and a RunningStats per
+    metric ("time", "memory", "peak_memory").
+    """
+    results = {}
+    for record in iter_records(file_path):
+        operations = results.setdefault(record["engine"], {}).setdefault(record["dataset"], {})
+        data = operations.setdefault(record["operation"], {"size": record["size"]})
+        stats = data.get(record["metric"])
+        if stats is None:
+            stats = data[record["metric"]] = RunningStats()
+        stats.add(record["value"])
     return results
 
-def plot_time_complexity(results, operations, output_dir="graphs"):
+def fit_growth(sizes, values):
     """
-    Plot time complexity for the given operations.
+    Least-squares fit of values = coefficient * size ** exponent on log-log axes.
+    Returns (exponent, coefficient); an exponent near 0 with a slow upward drift is what
+    O(log n) per-operation costs look like, 1 means linear. Needs two distinct sizes and
+    positive values, otherwise returns (nan, nan).
+    """
+    points = [(math.log(size), math.log(value)) for size, value in zip(sizes, values)
+              if size > 0 and value > 0]
+    if len({x for x, _ in points}) < 2:
+        return math.nan, math.nan
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    exponent = (sum((x - mean_x) * (y - mean_y) for x, y in points)
+                / sum((x - mean_x) ** 2 for x, _ in points))
+    return exponent, math.exp(mean_y - exponent * mean_x)
+
+def scaling_curve(datasets, operation, metric, band=(5, 95)):
+    """
+    Dataset sizes in increasing order with the median and the `band` percentiles of a
+    metric at each size.
+    """
+    sizes, medians, lows, highs = [], [], [], []
+    for dataset in sorted(datasets.values(), key=lambda dataset: dataset[operation]["size"]):
+        stats = dataset[operation][metric]
+        sizes.append(dataset[operation]["size"])
+        medians.append(stats.percentile(50))
+        lows.append(stats.percentile(band[0]))
+        highs.append(stats.percentile(band[1]))
+    return sizes, medians, lows, highs
+
+def plot_scaling(results, operations, metric, title, ylabel, file_suffix, output_dir="graphs"):
+    """
+    Plot the median of a metric against the dataset size on log-log axes, one line per
+    engine with a shaded 5th-95th percentile band and the fitted growth exponent in its
+    label. Returns {(engine, operation): exponent}.
     """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    exponents = {}
     for operation in operations:
         plt.figure(figsize=(10, 6))
+        all_positive = True
 
         for tree_type, datasets in results.items():
-            average_times = []
-            dataset_sizes = []
+            sizes, medians, lows, highs = scaling_curve(datasets, operation, metric)
+            exponent, _ = fit_growth(sizes, medians)
+            exponents[tree_type, operation] = exponent
+            all_positive = all_positive and min(lows, default=0) > 0
 
-            for dataset_name, dataset in datasets.items():
-                times = dataset[operation]["times"]
-                average_time = sum(times) / len(times)
-                average_times.append(average_time)
-                dataset_sizes.append(len(times))
+            line, = plt.plot(sizes, medians, marker="o", label=f"{tree_type} (n^{exponent:.2f})")
+            plt.fill_between(sizes, lows, highs, color=line.get_color(), alpha=0.2)
 
-            plt.plot(dataset_sizes, average_times, marker="o", label=tree_type)
-
-        plt.title(f"Time Complexity for {operation.capitalize()} Operation")
+        plt.xscale("log")
+        # Net memory can be zero or negative, which a log axis cannot show
+        plt.yscale("log" if all_positive else "symlog")
+        plt.title(f"{title} for {operation.capitalize()} Operation")
         plt.xlabel("Dataset Size")
-        plt.ylabel("Average Time (seconds)")
+        plt.ylabel(ylabel)
         plt.legend()
-        plt.grid()
-        plt.savefig(f"{output_dir}/{operation}_time_complexity.png")
+        plt.grid(which="both")
+        plt.savefig(f"{output_dir}/{operation}_{file_suffix}.png")
         plt.close()
+    return exponents
+
+def plot_time_complexity(results, operations, output_dir="graphs"):
+    """
+    Plot time complexity for the given operations.
+    """
+    return plot_scaling(results, operations, "time", "Time Complexity",
+                        "Median Time per Operation (seconds)", "time_complexity", output_dir)
 
 def plot_memory_usage(results, operations, output_dir="graphs"):
     """
     Plot memory usage for the given operations.
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    return plot_scaling(results, operations, "memory", "Memory Usage",
+                        "Median Memory Usage (MB)", "memory_usage", output_dir)
 
-    for operation in operations:
-        plt.figure(figsize=(10, 6))
+def _incomplete_beta(a, b, x):
+    # Regularized incomplete beta function I_x(a, b) by Lentz's continued fraction
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        return 1.0 - _incomplete_beta(b, a, 1 - x)
 
-        for tree_type, datasets in results.items():
-            average_memory = []
-            dataset_sizes = []
+    tiny = 1e-300
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                     + a * math.log(x) + b * math.log1p(-x)) / a
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    fraction = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            fraction *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return front * fraction
 
-            for dataset_name, dataset in datasets.items():
-                memory = dataset[operation]["memory"]
-                avg_memory = sum(memory) / len(memory)
-                average_memory.append(avg_memory)
-                dataset_sizes.append(len(memory))
+def welch_t_test(baseline, candidate):
+    """
+    One-sided Welch's t-test of "candidate mean > baseline mean" from two RunningStats.
+    Returns (t, degrees of freedom, p-value); the p-value is nan when either side has
+    fewer than two samples.
+    """
+    if baseline.count < 2 or candidate.count < 2:
+        return math.nan, math.nan, math.nan
+    baseline_error = baseline.variance() / baseline.count
+    candidate_error = candidate.variance() / candidate.count
+    standard_error = math.sqrt(baseline_error + candidate_error)
+    difference = candidate.mean - baseline.mean
+    if standard_error == 0:
+        # No spread on either side, so any difference at all is significant
+        return math.nan, math.inf, 0.0 if difference > 0 else 1.0
+    t = difference / standard_error
+    df = (baseline_error + candidate_error) ** 2 / (
+        baseline_error ** 2 / (baseline.count - 1) + candidate_error ** 2 / (candidate.count - 1))
+    # Upper tail of Student's t distribution
+    tail = 0.5 * _incomplete_beta(df / 2, 0.5, df / (df + t * t))
+    return t, df, tail if t > 0 else 1.0 - tail
 
-            plt.plot(dataset_sizes, average_memory, marker="o", label=tree_type)
+def compare(baseline, candidate, metric="time", alpha=0.05, threshold=0.0):
+    """
+    Compare two result sets loaded with load_results, cell by cell (engine, dataset,
+    operation). A cell is a regression when the candidate mean is more than `threshold`
+    (relative) above the baseline mean and Welch's t-test finds the slowdown significant
+    at level `alpha`. Returns one dict per cell present in both sets.
+    """
+    rows = []
+    for engine, datasets in baseline.items():
+        for dataset, operations in datasets.items():
+            for operation, data in operations.items():
+                other = candidate.get(engine, {}).get(dataset, {}).get(operation)
+                if other is None or metric not in data or metric not in other:
+                    continue
+                before, after = data[metric], other[metric]
+                t, df, p_value = welch_t_test(before, after)
+                change = after.mean / before.mean - 1 if before.mean else math.nan
+                rows.append({
+                    "engine": engine, "dataset": dataset, "operation": operation,
+                    "baseline": before.mean, "candidate": after.mean, "change": change,
+                    "t": t, "p_value": p_value,
+                    "regression": change > threshold and p_value < alpha,
+                })
+    return rows
 
-        plt.title(f"Memory Usage for {operation.capitalize()} Operation")
-        plt.xlabel("Dataset Size")
-        plt.ylabel("Average Memory Usage (MB)")
-        plt.legend()
-        plt.grid()
-        plt.savefig(f"{output_dir}/{operation}_memory_usage.png")
-        plt.close()
+def print_comparison(rows):
+    print(f"{'Engine':<14}{'Dataset':<24}{'Operation':<11}{'Baseline':>12}{'Candidate':>12}"
+          f"{'Change':>9}{'p':>9}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['engine']:<14}{row['dataset']:<24}{row['operation']:<11}{row['baseline']:>12.4g}"
+              f"{row['candidate']:>12.4g}{row['change']:>+9.1%}{row['p_value']:>9.3g}{flag}")
 
-def generate_performance_graphs():
+def generate_performance_graphs(results_file=RESULTS_FILE, output_dir="graphs"):
     """
     Generate performance graphs for benchmark results.
     """
-    results_file = "../result/benchmark_results.txt"  # Path to the custom results file
-    output_dir = "graphs"
-
     # Load the benchmark results
     results = load_results(results_file)
 
-    # Define the operations to analyze
-    operations = ["insert", "search", "delete"]
-
     # Generate time complexity graphs
     print("Generating time complexity graphs...")
-    plot_time_complexity(results, operations, output_dir)
+    exponents = plot_time_complexity(results, OPERATIONS, output_dir)
+    for (tree_type, operation), exponent in sorted(exponents.items()):
+        print(f"  {tree_type} {operation}: time per operation grows as n^{exponent:.3f}")
 
     # Generate memory usage graphs
     print("Generating memory usage graphs...")
-    plot_memory_usage(results, operations, output_dir)
+    plot_memory_usage(results, OPERATIONS, output_dir)
 
     print(f"Graphs generated and saved in the {output_dir}/ directory.")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Plot benchmark results or compare two result sets.")
+    parser.add_argument("--results", default=RESULTS_FILE,
+                        help="results file written by benchmark.py")
+    parser.add_argument("--output-dir", default="graphs")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="compare two results files instead of plotting")
+    parser.add_argument("--metric", default="time", help="metric to compare")
+    parser.add_argument("--alpha", type=float, default=0.05, help="significance level of --compare")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="relative slowdown to ignore, e.g. 0.05 for 5%%")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    generate_performance_graphs()
+    args = parse_args()
+    if args.compare:
+        rows = compare(load_results(args.compare[0]), load_results(args.compare[1]),
+                       args.metric, args.alpha, args.threshold)
+        print_comparison(rows)
+        # Non-zero exit status so a CI job fails on a regression
+        sys.exit(1 if any(row["regression"] for row in rows) else 0)
+    generate_performance_graphs(args.results, args.output_dir)
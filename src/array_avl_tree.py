@@ -1,120 +1,1438 @@
 import array
+import heapq
+import json
+import mmap
+import struct
+import sys
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only search_batch needs it
+    np = None
+
+# Typecode for a plain Python list instead of an array.array, for keys or values of any type
+OBJECT_TYPECODE = 'O'
+
+_MISSING = object()
+
+# On-disk format: magic, format version and JSON header length, then the JSON header and
+# the raw per-node buffers, each starting on an 8-byte boundary
+FILE_MAGIC = b"AVLTREE\0"
+FILE_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+
 
 class ArrayAVLTree:
-    def __init__(self, capacity=1000):
+    def __init__(self, capacity=1000, order_stats=False, key_typecode='i', value_typecode=None,
+                 compact_threshold=None, compact_layout="bfs", multiset=False, tombstone_threshold=None,
+                 search_cache=None, finger_search=False):
+        if multiset and value_typecode is not None:
+            raise ValueError("Multiset mode cannot be combined with map mode")
         self.capacity = capacity
+        # size is the number of slots handed out so far, node_count the number of live nodes
+        # and length the number of stored keys, duplicates included
         self.size = 0
-        self.keys = array.array('i', [0] * capacity)
+        self.node_count = 0
+        self.length = 0
+        self.key_typecode = key_typecode
+        self.keys = self._new_store(key_typecode, [self._fill(key_typecode)] * capacity)
         self.heights = array.array('i', [0] * capacity)
         self.left = array.array('i', [-1] * capacity)
         self.right = array.array('i', [-1] * capacity)
+        # Optional subtree sizes for rank/select, kept up to date by rotations and retracing
+        self.sizes = array.array('i', [0] * capacity) if order_stats else None
+        # Multiset mode stores every distinct key once, with its number of occurrences.
+        # Lazy deletes keep counts too, a node whose count dropped to 0 is a tombstone.
+        self.multiset = multiset
+        lazy = tombstone_threshold is not None
+        self.counts = array.array('I', [0] * capacity) if multiset or lazy else None
+        # When set, deletes only turn nodes into tombstones, and the tree is rebuilt from its
+        # live keys once the tombstones exceed this fraction of the nodes
+        self.tombstone_threshold = tombstone_threshold
+        self.tombstones = 0
+        # Map mode keeps one value per node in a parallel store, set mode has none
+        self.value_typecode = value_typecode
+        self.values = None
+        if value_typecode is not None:
+            self.values = self._new_store(value_typecode, [self._fill(value_typecode)] * capacity)
         self.root = -1
+        # Slots freed by delete are chained through the left array, height 0 marks them dead
+        self.free_head = -1
+        # When set, deletes compact the arrays once this fraction of the handed out slots is dead
+        self.compact_threshold = compact_threshold
+        self.compact_layout = compact_layout
+        # Set by open() when the stores are views over a memory-mapped file
+        self.read_only = False
+        self._mapping = None
+        # Optional LRU cache of search results, at most search_cache keys mapped to their node
+        # (or -1). Rotations only relink slots, so just the keys whose slot appears, moves or
+        # is released are evicted; bulk operations clear it.
+        self.search_cache = search_cache
+        self.cache = OrderedDict() if search_cache else None
+        # Finger search resumes from the path of the previous search, kept as
+        # (node, lower bound, upper bound) entries. Any change to the shape drops it.
+        self.finger_search = finger_search
+        self.finger = None
+
+    def __len__(self):
+        return self.length
+
+    @staticmethod
+    def _new_store(typecode, items):
+        if typecode == OBJECT_TYPECODE:
+            return list(items)
+        return array.array(typecode, items)
+
+    @staticmethod
+    def _fill(typecode):
+        return None if typecode == OBJECT_TYPECODE else 0
+
+    @classmethod
+    def from_sorted(cls, keys, values=None, **options):
+        # Build a height-balanced tree from already sorted keys in one linear pass.
+        # Slot i holds the i-th smallest key, so the keys array is copied as is.
+        tree = cls(**options)
+        keys = tree._new_store(tree.key_typecode, keys)
+        for i in range(1, len(keys)):
+            if keys[i - 1] > keys[i]:
+                raise ValueError("Keys must be sorted")
+        tree._load_sorted(keys, values)
+        return tree
+
+    @classmethod
+    def from_iterable(cls, keys, **options):
+        return cls.from_sorted(sorted(keys), **options)
+
+    def _load_sorted(self, keys, values=None, counts=None):
+        # Replace the whole tree with a balanced one holding the sorted keys in slots 0..n-1,
+        # with counts (if given) holding the occurrences of each key
+        keys = self._new_store(self.key_typecode, keys)
+        self.length = len(keys) if counts is None else sum(counts)
+        if self.multiset and counts is None:
+            keys, counts = self._group_runs(keys)
+        elif counts is None and self.counts is not None:
+            counts = array.array('I', [1]) * len(keys)
+        n = len(keys)
+        if self.capacity < n:
+            self._grow(n)
+        old_size = self.size
+        self.keys[:n] = keys
+        if self.counts is not None:
+            self.counts[:n] = counts
+        if self.values is not None:
+            if values is None:
+                values = [self._fill(self.value_typecode)] * n
+            values = self._new_store(self.value_typecode, values)
+            if len(values) != n:
+                raise ValueError("Expected one value per key")
+            self.values[:n] = values
+        if old_size > n:
+            self.heights[n:old_size] = array.array('i', [0]) * (old_size - n)
+        self.size = n
+        self.node_count = n
+        self.tombstones = 0
+        self.free_head = -1
+        self._forget_all()
+        self.root = self._build_balanced(0, n)
+
+    def _group_runs(self, keys):
+        # Collapse every run of equal sorted keys into a single key and its count
+        unique = self._new_store(self.key_typecode, [])
+        counts = array.array('I')
+        for key in keys:
+            if unique and unique[-1] == key:
+                counts[-1] += 1
+            else:
+                unique.append(key)
+                counts.append(1)
+        return unique, counts
+
+    def _build_balanced(self, lo, hi, slots=None):
+        # Link positions lo..hi-1 into a balanced subtree, position i living in slot i
+        # (or slots[i] when given)
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        node_index = mid if slots is None else slots[mid]
+        self.left[node_index] = self._build_balanced(lo, mid, slots)
+        self.right[node_index] = self._build_balanced(mid + 1, hi, slots)
+        # A subtree built from m keys by midpoint splitting has height bit_length(m)
+        self.heights[node_index] = (hi - lo).bit_length()
+        if self.sizes is not None:
+            self._update_size(node_index)
+        return node_index
 
     def insert(self, key):
+        self._require_writable()
         self.root = self._insert(self.root, key)
 
-    def _insert(self, node_index, key):
-        if node_index == -1:
-            if self.size >= self.capacity:
-                raise Exception("Tree is full")
-            node_index = self.size
-            self.keys[node_index] = key
-            self.heights[node_index] = 1
-            self.left[node_index] = -1
-            self.right[node_index] = -1
-            self.size += 1
-            return node_index
+    def _insert(self, node_index, key, value=None, replace=False):
+        keys = self.keys
+        left = self.left
+        right = self.right
 
-        if key < self.keys[node_index]:
-            self.left[node_index] = self._insert(self.left[node_index], key)
+        # Standard BST descent, remembering the path for retracing
+        path = []
+        current = node_index
+        while current != -1:
+            node_key = keys[current]
+            if node_key == key:
+                if self.tombstone_threshold is not None and not self.counts[current]:
+                    # Revive a tombstone holding the key instead of adding a node
+                    self.tombstones -= 1
+                    self._forget(key)
+                    if self.values is not None:
+                        self.values[current] = self._fill(self.value_typecode) if value is None else value
+                    self._bump(path, current)
+                    return node_index
+                if replace:
+                    # Map put on an existing key only overwrites the value
+                    self.values[current] = value
+                    return node_index
+                if self.multiset:
+                    # Multiset insert of a present key only bumps its count, the shape never changes
+                    self._bump(path, current)
+                    return node_index
+            path.append(current)
+            if key < node_key:
+                current = left[current]
+            else:
+                current = right[current]
+
+        # Allocation may grow (and so replace) the stores
+        child = self._allocate()
+        self._forget(key)
+        left = self.left
+        right = self.right
+        self.keys[child] = key
+        if self.values is not None:
+            self.values[child] = self._fill(self.value_typecode) if value is None else value
+        self.heights[child] = 1
+        self.left[child] = -1
+        self.right[child] = -1
+        if self.counts is not None:
+            self.counts[child] = 1
+        if self.sizes is not None:
+            self.sizes[child] = 1
+        self.length += 1
+        if path:
+            parent = path[-1]
+            if key < keys[parent]:
+                left[parent] = child
+            else:
+                right[parent] = child
+
+        return self._retrace(path, child, child, 1)
+
+    def _bump(self, path, node_index):
+        # Add one occurrence to an existing node found at the end of path
+        self.counts[node_index] += 1
+        self.length += 1
+        if self.sizes is not None:
+            for ancestor in path:
+                self.sizes[ancestor] += 1
+            self.sizes[node_index] += 1
+
+    def delete(self, key):
+        # Remove one occurrence of key
+        self._require_writable()
+        self._remove(key)
+        self._maybe_compact()
+
+    def delete_all(self, key):
+        # Remove every occurrence of key and return how many there were
+        self._require_writable()
+        length = self.length
+        if self.multiset:
+            self._remove(key, remove_all=True)
         else:
-            self.right[node_index] = self._insert(self.right[node_index], key)
+            while True:
+                before = self.length
+                self._remove(key)
+                if self.length == before:
+                    break
+        self._maybe_compact()
+        return length - self.length
 
-        self.heights[node_index] = 1 + max(self._get_height(self.left[node_index]),
-                                           self._get_height(self.right[node_index]))
+    def count(self, key):
+        # Number of stored occurrences of key
+        if self.multiset:
+            node_index = self.search(key)
+            return self.counts[node_index] if node_index != -1 else 0
+        occurrences = 0
+        for node_index in self._live_nodes(key):
+            if self.keys[node_index] != key:
+                break
+            occurrences += 1
+        return occurrences
 
-        balance = self._get_balance(node_index)
+    def _remove(self, key, remove_all=False):
+        if self.tombstone_threshold is None:
+            self.root = self._delete(self.root, key, remove_all)
+            return
+        path = self._find_live(key)
+        if path is not None:
+            self._bury(path, remove_all)
 
-        # Left Left Case
-        if balance > 1 and key < self.keys[self.left[node_index]]:
-            return self._right_rotate(node_index)
+    def _find_live(self, key):
+        # Path from the root to a node holding a live occurrence of key, None if there is none.
+        # Equal keys form one inorder run, so past a tombstone both subtrees may hold the key.
+        keys = self.keys
+        left = self.left
+        right = self.right
+        counts = self.counts
+        path = []
+        current = self.root
+        while current != -1 and keys[current] != key:
+            path.append(current)
+            if key < keys[current]:
+                current = left[current]
+            else:
+                current = right[current]
+        if current == -1:
+            return None
+        if counts[current]:
+            path.append(current)
+            return path
 
-        # Right Right Case
-        if balance < -1 and key > self.keys[self.right[node_index]]:
-            return self._left_rotate(node_index)
+        pending = [(current, len(path))]
+        while pending:
+            current, depth = pending.pop()
+            del path[depth:]
+            while current != -1:
+                path.append(current)
+                node_key = keys[current]
+                if node_key == key:
+                    if counts[current]:
+                        return path
+                    pending.append((left[current], len(path)))
+                    current = right[current]
+                elif key < node_key:
+                    current = left[current]
+                else:
+                    current = right[current]
+        return None
 
-        # Left Right Case
-        if balance > 1 and key > self.keys[self.left[node_index]]:
-            self.left[node_index] = self._left_rotate(self.left[node_index])
-            return self._right_rotate(node_index)
+    def _bury(self, path, remove_all=False):
+        # Lazy delete: drop occurrences in place and leave a node without any linked as a
+        # tombstone. The shape never changes, so there is no successor copy or retracing.
+        node_index = path[-1]
+        counts = self.counts
+        removed = counts[node_index] if remove_all or not self.multiset else 1
+        counts[node_index] -= removed
+        self.length -= removed
+        if self.sizes is not None:
+            for ancestor in path:
+                self.sizes[ancestor] -= removed
+        if counts[node_index]:
+            return
+        self.tombstones += 1
+        self._forget(self.keys[node_index])
+        # Drop the value so a tombstone does not keep the object alive
+        if self.value_typecode == OBJECT_TYPECODE:
+            self.values[node_index] = None
+        if self.tombstones > self.tombstone_threshold * self.node_count:
+            self.purge()
 
-        # Right Left Case
-        if balance < -1 and key < self.keys[self.right[node_index]]:
-            self.right[node_index] = self._right_rotate(self.right[node_index])
-            return self._left_rotate(node_index)
+    def purge(self):
+        # Rebuild from the live nodes in key order, dropping every tombstone
+        self._require_writable()
+        nodes = list(self._live_nodes())
+        self._load_sorted([self.keys[i] for i in nodes],
+                          None if self.values is None else [self.values[i] for i in nodes],
+                          array.array('I', [self.counts[i] for i in nodes]))
 
-        return node_index
+    def _delete(self, node_index, key, remove_all=False):
+        keys = self.keys
+        left = self.left
+        right = self.right
+        counts = self.counts
+        sizes = self.sizes
 
-    def delete(self, key):
-        self.root = self._delete(self.root, key)
+        path = []
+        current = node_index
+        while current != -1 and keys[current] != key:
+            path.append(current)
+            if key < keys[current]:
+                current = left[current]
+            else:
+                current = right[current]
 
-    def _delete(self, node_index, key):
-        if node_index == -1:
+        if current == -1:
             return node_index
 
-        if key < self.keys[node_index]:
-            self.left[node_index] = self._delete(self.left[node_index], key)
-        elif key > self.keys[node_index]:
-            self.right[node_index] = self._delete(self.right[node_index], key)
-        else:
-            if self.left[node_index] == -1:
-                return self.right[node_index]
-            elif self.right[node_index] == -1:
-                return self.left[node_index]
+        removed = 1
+        if counts is not None:
+            if counts[current] > 1 and not remove_all:
+                # Multiset delete of one of several occurrences only drops the count
+                counts[current] -= 1
+                self.length -= 1
+                if sizes is not None:
+                    path.append(current)
+                    for ancestor in path:
+                        sizes[ancestor] -= 1
+                return node_index
+            removed = counts[current]
+        self.length -= removed
+        self._forget(key)
 
-            min_node = self._get_min_value_node(self.right[node_index])
-            self.keys[node_index] = self.keys[min_node]
-            self.right[node_index] = self._delete(self.right[node_index], self.keys[min_node])
+        # Node with two children: copy the inorder successor up and unlink that node instead
+        if left[current] != -1 and right[current] != -1:
+            target_position = len(path)
+            path.append(current)
+            successor = right[current]
+            while left[successor] != -1:
+                path.append(successor)
+                successor = left[successor]
+            keys[current] = keys[successor]
+            if self.values is not None:
+                self.values[current] = self.values[successor]
+            if counts is not None:
+                counts[current] = counts[successor]
+                # Retracing shifts the sizes it does not recompute by -removed, but the
+                # subtrees between the two nodes only lose the successor's occurrences
+                if sizes is not None:
+                    for ancestor in path[target_position + 1:]:
+                        sizes[ancestor] += removed - counts[successor]
+            current = successor
 
-        if node_index == -1:
-            return node_index
+        child = left[current] if left[current] != -1 else right[current]
+        self._release(current)
 
-        self.heights[node_index] = 1 + max(self._get_height(self.left[node_index]),
-                                           self._get_height(self.right[node_index]))
+        return self._retrace(path, current, child, -removed)
 
-        balance = self._get_balance(node_index)
+    def _retrace(self, path, old_child, child, delta):
+        # Walk back up the path, relinking the replaced subtree and rebalancing.
+        # Once a subtree comes out with the same height it had before, nothing above it changes
+        # except the subtree sizes, which shift by delta all the way to the root.
+        left = self.left
+        right = self.right
+        heights = self.heights
+        self.finger = None
 
-        # Left Left Case
-        if balance > 1 and self._get_balance(self.left[node_index]) >= 0:
-            return self._right_rotate(node_index)
+        for i in range(len(path) - 1, -1, -1):
+            parent = path[i]
+            if left[parent] == old_child:
+                left[parent] = child
+            else:
+                right[parent] = child
 
-        # Right Right Case
-        if balance < -1 and self._get_balance(self.right[node_index]) <= 0:
-            return self._left_rotate(node_index)
+            old_height = heights[parent]
+            old_child = parent
+            child = self._rebalance(parent)
 
-        # Left Right Case
-        if balance > 1 and self._get_balance(self.left[node_index]) < 0:
-            self.left[node_index] = self._left_rotate(self.left[node_index])
+            if heights[child] == old_height:
+                if i == 0:
+                    return child
+                grandparent = path[i - 1]
+                if left[grandparent] == old_child:
+                    left[grandparent] = child
+                else:
+                    right[grandparent] = child
+                sizes = self.sizes
+                if sizes is not None:
+                    for j in range(i):
+                        sizes[path[j]] += delta
+                return path[0]
+
+        return child
+
+    def _rebalance(self, node_index):
+        heights = self.heights
+        left_child = self.left[node_index]
+        right_child = self.right[node_index]
+        left_height = heights[left_child] if left_child != -1 else 0
+        right_height = heights[right_child] if right_child != -1 else 0
+        balance = left_height - right_height
+
+        if balance > 1:
+            # Left Left Case
+            if self._get_balance(left_child) >= 0:
+                return self._right_rotate(node_index)
+
+            # Left Right Case
+            self.left[node_index] = self._left_rotate(left_child)
             return self._right_rotate(node_index)
 
-        # Right Left Case
-        if balance < -1 and self._get_balance(self.right[node_index]) > 0:
-            self.right[node_index] = self._right_rotate(self.right[node_index])
+        if balance < -1:
+            # Right Right Case
+            if self._get_balance(right_child) <= 0:
+                return self._left_rotate(node_index)
+
+            # Right Left Case
+            self.right[node_index] = self._right_rotate(right_child)
             return self._left_rotate(node_index)
 
+        heights[node_index] = 1 + (left_height if left_height > right_height else right_height)
+        if self.sizes is not None:
+            self._update_size(node_index)
+        return node_index
+
+    def _allocate(self):
+        # Reuse a freed slot first, otherwise take the next fresh one and grow when out of room
+        self._require_writable()
+        if self.free_head != -1:
+            node_index = self.free_head
+            self.free_head = self.left[node_index]
+        else:
+            if self.size >= self.capacity:
+                self._grow()
+            node_index = self.size
+            self.size += 1
+        self.node_count += 1
         return node_index
 
+    def _release(self, node_index):
+        self._forget(self.keys[node_index])
+        self.finger = None
+        self.heights[node_index] = 0
+        # Drop references held by object stores so freed keys and values can be collected
+        if self.key_typecode == OBJECT_TYPECODE:
+            self.keys[node_index] = None
+        if self.value_typecode == OBJECT_TYPECODE:
+            self.values[node_index] = None
+        self.left[node_index] = self.free_head
+        self.right[node_index] = -1
+        self.free_head = node_index
+        self.node_count -= 1
+
+    def _grow(self, min_capacity=0):
+        # Geometric growth keeps the amortized cost of an insert constant
+        if self._mapping is not None:
+            self._materialize()
+        extra = max(self.capacity, 16, min_capacity - self.capacity)
+        for name, typecode in self._stores():
+            fill = -1 if name in ("left", "right") else self._fill(typecode)
+            getattr(self, name).extend(self._new_store(typecode, [fill]) * extra)
+        self.capacity += extra
+
+    def _stores(self):
+        # Every per-node store as (attribute name, typecode)
+        stores = [("keys", self.key_typecode), ("heights", 'i'), ("left", 'i'), ("right", 'i')]
+        if self.sizes is not None:
+            stores.append(("sizes", 'i'))
+        if self.values is not None:
+            stores.append(("values", self.value_typecode))
+        if self.counts is not None:
+            stores.append(("counts", 'I'))
+        return stores
+
     def search(self, key):
+        cache = self.cache
+        if cache is None:
+            return self._lookup(key)
+        node_index = cache.get(key)
+        if node_index is not None:
+            cache.move_to_end(key)
+            return node_index
+        node_index = cache[key] = self._lookup(key)
+        if len(cache) > self.search_cache:
+            cache.popitem(last=False)
+        return node_index
+
+    def _lookup(self, key):
+        if self.finger_search:
+            node_index = self._finger_lookup(key)
+            if node_index == -1 or self.tombstone_threshold is None or self.counts[node_index]:
+                return node_index
+        if self.tombstone_threshold is not None:
+            path = self._find_live(key)
+            return path[-1] if path is not None else -1
         return self._search(self.root, key)
 
+    def _finger_lookup(self, key):
+        # Climb the previous search path to the deepest node whose subtree must hold key if it
+        # is stored at all (key strictly between the subtree bounds), then descend from there.
+        # A key d positions away from the previous one typically costs O(log d); like any
+        # finger without level links, keys on either side of a high node still climb far.
+        finger = self.finger
+        if not finger:
+            finger = self.finger = [(self.root, None, None)]
+        while len(finger) > 1:
+            _, lo, hi = finger[-1]
+            if (lo is None or lo < key) and (hi is None or key < hi):
+                break
+            finger.pop()
+        node_index, lo, hi = finger[-1]
+
+        keys = self.keys
+        left = self.left
+        right = self.right
+        while node_index != -1:
+            node_key = keys[node_index]
+            if node_key == key:
+                return node_index
+            if key < node_key:
+                node_index = left[node_index]
+                hi = node_key
+            else:
+                node_index = right[node_index]
+                lo = node_key
+            if node_index != -1:
+                finger.append((node_index, lo, hi))
+        return -1
+
+    def _forget(self, key):
+        # Evict one key from the search cache
+        if self.cache is not None:
+            self.cache.pop(key, None)
+
+    def _forget_all(self):
+        # Drop the search cache and the finger after a bulk change of the tree
+        if self.cache is not None:
+            self.cache.clear()
+        self.finger = None
+
     def _search(self, node_index, key):
+        keys = self.keys
+        left = self.left
+        right = self.right
+        while node_index != -1:
+            node_key = keys[node_index]
+            if node_key == key:
+                return node_index
+            if key < node_key:
+                node_index = left[node_index]
+            else:
+                node_index = right[node_index]
+        return -1
+
+    def get(self, key, default=None):
+        values = self._require_values()
+        node_index = self.search(key)
+        if node_index == -1:
+            return default
+        return values[node_index]
+
+    def put(self, key, value):
+        self._require_values()
+        self._require_writable()
+        self.root = self._insert(self.root, key, value, replace=True)
+
+    def pop(self, key, default=_MISSING):
+        values = self._require_values()
+        self._require_writable()
+        node_index = self.search(key)
         if node_index == -1:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        value = values[node_index]
+        self.delete(key)
+        return value
+
+    def _require_values(self):
+        if self.values is None:
+            raise ValueError("Map mode is not enabled, create the tree with a value_typecode")
+        return self.values
+
+    def _require_writable(self):
+        if self.read_only:
+            raise TypeError("Tree was opened read-only")
+
+    def insert_many(self, keys):
+        self._require_writable()
+        batch = sorted(keys)
+        # A batch comparable to the tree size is cheaper to merge with the inorder keys
+        # and rebuild in one linear pass than to insert key by key
+        if len(batch) * 4 >= self.node_count:
+            if self.values is None:
+                self._load_sorted(heapq.merge(self, batch))
+            else:
+                fill = self._fill(self.value_typecode)
+                merged = list(heapq.merge(self.items(), [(key, fill) for key in batch], key=itemgetter(0)))
+                self._load_sorted([item[0] for item in merged], [item[1] for item in merged])
+            return
+        # Otherwise insert in sorted order so consecutive keys walk mostly the same path
+        root = self.root
+        for key in batch:
+            root = self._insert(root, key)
+        self.root = root
+
+    def search_many(self, keys):
+        # One merged descent for the whole sorted batch: at each node the batch range is
+        # split around the node key, so neighbouring keys share their path prefix
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        batch = [keys[i] for i in order]
+        results = array.array('i', [-1]) * len(keys)
+
+        node_keys = self.keys
+        left = self.left
+        right = self.right
+        stack = [(self.root, 0, len(batch))]
+        while stack:
+            node_index, lo, hi = stack.pop()
+            if node_index == -1 or lo >= hi:
+                continue
+            node_key = node_keys[node_index]
+            mid_lo = bisect_left(batch, node_key, lo, hi)
+            mid_hi = bisect_right(batch, node_key, mid_lo, hi)
+            for j in range(mid_lo, mid_hi):
+                results[order[j]] = node_index
+            stack.append((left[node_index], lo, mid_lo))
+            stack.append((right[node_index], mid_hi, hi))
+        if self.tombstones:
+            self._skip_tombstones(results, keys)
+        return results
+
+    def _skip_tombstones(self, results, keys):
+        # Redo the lookups that stopped at a tombstone, a live copy of the key may lie below
+        counts = self.counts
+        for i, node_index in enumerate(results):
+            if node_index != -1 and not counts[node_index]:
+                results[i] = self.search(keys[i])
+
+    def search_batch(self, queries):
+        # Vectorized lookup: every query advances one level per step with a
+        # compare-and-select over zero-copy NumPy views of the node arrays
+        if np is None:
+            raise ImportError("search_batch requires NumPy")
+        if self.key_typecode == OBJECT_TYPECODE:
+            raise TypeError("search_batch requires keys stored in a typed array")
+        queries = np.asarray(queries)
+        result = np.full(queries.shape, -1, dtype=np.intp)
+        if self.root == -1 or queries.size == 0:
+            return result
+
+        keys = np.frombuffer(self.keys, dtype=self.key_typecode)
+        left = np.frombuffer(self.left, dtype='i')
+        right = np.frombuffer(self.right, dtype='i')
+
+        flat_queries = queries.ravel()
+        flat_result = result.reshape(-1)
+        active = np.arange(flat_queries.size)
+        nodes = np.full(flat_queries.size, self.root, dtype=np.intp)
+        while active.size:
+            node_keys = keys[nodes]
+            pending = flat_queries[active]
+            hit = node_keys == pending
+            flat_result[active[hit]] = nodes[hit]
+            nodes = np.where(pending < node_keys, left[nodes], right[nodes])
+            walking = ~hit & (nodes != -1)
+            active = active[walking]
+            nodes = nodes[walking]
+        if self.tombstones:
+            # Queries that stopped at a tombstone fall back to a scalar lookup
+            found = np.flatnonzero(flat_result != -1)
+            counts = np.frombuffer(self.counts, dtype='I')
+            for i in found[counts[flat_result[found]] == 0]:
+                flat_result[i] = self.search(flat_queries[i].item())
+        return result
+
+    def delete_many(self, keys):
+        self._require_writable()
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        deleted = [False] * len(keys)
+
+        if len(keys) * 4 >= self.node_count:
+            # Walk the inorder keys and the sorted batch together, dropping one stored
+            # occurrence per requested key, then rebuild from the survivors
+            survivors = []
+            j = 0
+            for node_index in self._range_nodes():
+                key = self.keys[node_index]
+                remaining = self.counts[node_index] if self.counts is not None else 1
+                while j < len(order) and keys[order[j]] < key:
+                    j += 1
+                while remaining and j < len(order) and keys[order[j]] == key:
+                    deleted[order[j]] = True
+                    j += 1
+                    remaining -= 1
+                survivors.extend([node_index] * remaining)
+            self._load_sorted([self.keys[i] for i in survivors],
+                              None if self.values is None else [self.values[i] for i in survivors])
+            return deleted
+
+        for i in order:
+            length = self.length
+            self._remove(keys[i])
+            deleted[i] = self.length < length
+        self._maybe_compact()
+        return deleted
+
+    def split(self, key):
+        # Move every key >= key into a new tree with the same options and return it. Cutting
+        # the tree is O(log n); only the half with the smaller height is then copied out of
+        # this arena, and swapped in if it is the half this tree keeps.
+        self._require_writable()
+        if self.tombstones:
+            self.purge()
+        lower, upper = self._split(self.root, key)
+        other = self._spawn()
+        if self._get_height(lower) <= self._get_height(upper):
+            self.root = upper
+            self._move_to(lower, other)
+            self._swap_arenas(other)
+        else:
+            self.root = lower
+            self._move_to(upper, other)
+        return other
+
+    def join(self, key, other, value=None):
+        # Append key (with value in map mode) and every key of other, which must all be
+        # >= key >= every key of this tree. other is left empty. The smaller of the two trees
+        # is copied into the arena of the larger one, the join itself is O(log n).
+        self._require_writable()
+        other._require_writable()
+        self._check_join(key, other)
+        # Keep the larger arena: swap it in here and copy this tree's keys across instead
+        swap = len(other) > len(self) and self._compatible(other)
+        if swap:
+            self._swap_arenas(other)
+        if self.tombstones:
+            self.purge()
+        kept = self.root
+        adopted = self._adopt(other)
+        left, right = (adopted, kept) if swap else (kept, adopted)
+        other._load_sorted([])
+
+        node_index = self._allocate()
+        self.keys[node_index] = key
+        if self.values is not None:
+            self.values[node_index] = self._fill(self.value_typecode) if value is None else value
+        if self.counts is not None:
+            self.counts[node_index] = 1
+        self.length += 1
+        self.root = self._link(left, node_index, right)
+
+    def _check_join(self, key, other):
+        last = next(self.range(reverse=True), None)
+        first = next(iter(other), None)
+        if (last is not None and last > key) or (first is not None and first < key):
+            raise ValueError("join needs every key of this tree <= key <= every key of other")
+        if self.multiset and key in (last, first):
+            raise ValueError("join cannot store a key twice in multiset mode")
+
+    def union(self, other):
+        # Add every key of other. A key found in both trees is stored once, except in multiset
+        # mode where the occurrences add up, and in map mode the value from other wins.
+        # Join-based divide and conquer, O(m log(n/m + 1)) for trees of n and m keys once the
+        # keys of other are copied into this arena.
+        self._require_writable()
+        if self.tombstones:
+            self.purge()
+        self.root = self._unite(self.root, self._adopt(other))
+
+    def intersection(self, other):
+        # Keep only the keys also found in other (in multiset mode the smaller count)
+        self._require_writable()
+        if self.tombstones:
+            self.purge()
+        self.root = self._intersect(self.root, self._adopt(other))
+        self._maybe_compact()
+
+    def difference(self, other):
+        # Remove the keys found in other (in multiset mode as many occurrences as other holds)
+        self._require_writable()
+        if self.tombstones:
+            self.purge()
+        self.root = self._subtract(self.root, self._adopt(other))
+        self._maybe_compact()
+
+    def delete_range(self, lo, hi):
+        # Remove every key in [lo, hi) with two splits and one join, and return how many there were
+        self._require_writable()
+        length = self.length
+        left, rest = self._split(self.root, lo)
+        middle, right = self._split(rest, hi)
+        self._discard(middle)
+        self.root = self._concat(left, right)
+        self._maybe_compact()
+        return length - self.length
+
+    def _unite(self, a, b):
+        if a == -1:
+            return b
+        if b == -1:
+            return a
+        key = self.keys[a]
+        a_left, a_right = self.left[a], self.right[a]
+        b_left, b_right = self._split(b, key)
+        match, b_right = self._take_first(b_right, key)
+        if match != -1:
+            if self.multiset:
+                # The occurrences move over, the length already counts them
+                self.counts[a] += self.counts[match]
+            else:
+                self.length -= 1
+            if self.values is not None:
+                self.values[a] = self.values[match]
+            self._release(match)
+        return self._link(self._unite(a_left, b_left), a, self._unite(a_right, b_right))
+
+    def _intersect(self, a, b):
+        if a == -1 or b == -1:
+            self._discard(a)
+            self._discard(b)
             return -1
-        if self.keys[node_index] == key:
+        key = self.keys[a]
+        a_left, a_right = self.left[a], self.right[a]
+        b_left, b_right = self._split(b, key)
+        match, b_right = self._take_first(b_right, key)
+        left = self._intersect(a_left, b_left)
+        right = self._intersect(a_right, b_right)
+        if match == -1:
+            self._drop(a)
+            return self._concat(left, right)
+        if self.multiset and self.counts[match] < self.counts[a]:
+            self.length -= self.counts[a] - self.counts[match]
+            self.counts[a] = self.counts[match]
+        self._drop(match)
+        return self._link(left, a, right)
+
+    def _subtract(self, a, b):
+        if a == -1 or b == -1:
+            self._discard(b)
+            return a
+        key = self.keys[b]
+        b_left, b_right = self.left[b], self.right[b]
+        removed = self.counts[b] if self.counts is not None else 1
+        self._drop(b)
+        a_left, a_right = self._split(a, key)
+        match, a_right = self._take_first(a_right, key)
+        left = self._subtract(a_left, b_left)
+        right = self._subtract(a_right, b_right)
+        if match != -1:
+            if self.multiset and self.counts[match] > removed:
+                self.counts[match] -= removed
+                self.length -= removed
+                return self._link(left, match, right)
+            self._drop(match)
+        return self._concat(left, right)
+
+    def _link(self, left, node_index, right):
+        # Join two subtrees and a detached node between them (keys of left <= its key <= keys
+        # of right): hang the node and the shorter subtree off the inner spine of the taller
+        # one at a subtree of about the same height, then retrace the spine
+        self._forget_all()
+        heights = self.heights
+        left_height = heights[left] if left != -1 else 0
+        right_height = heights[right] if right != -1 else 0
+        path = []
+        spine = -1
+        if left_height > right_height + 1:
+            spine = left
+            while spine != -1 and heights[spine] > right_height + 1:
+                path.append(spine)
+                spine = self.right[spine]
+            left = spine
+            other_side = right
+        elif right_height > left_height + 1:
+            spine = right
+            while spine != -1 and heights[spine] > left_height + 1:
+                path.append(spine)
+                spine = self.left[spine]
+            right = spine
+            other_side = left
+        self.left[node_index] = left
+        self.right[node_index] = right
+        self.heights[node_index] = 1 + max(self._get_height(left), self._get_height(right))
+        if self.sizes is not None:
+            self._update_size(node_index)
+        if not path:
             return node_index
-        if key < self.keys[node_index]:
-            return self._search(self.left[node_index], key)
-        return self._search(self.right[node_index], key)
+        delta = 0
+        if self.sizes is not None:
+            delta = self.sizes[node_index] - (self.sizes[spine] if spine != -1 else 0)
+        return self._retrace(path, spine, node_index, delta)
+
+    def _split(self, node_index, key):
+        # Cut a subtree into two: the keys < key and the keys >= key. Every node on the search
+        # path is rejoined to the side it belongs to, O(log n) in total.
+        keys = self.keys
+        path = []
+        while node_index != -1:
+            path.append(node_index)
+            node_index = self.left[node_index] if key <= keys[node_index] else self.right[node_index]
+        lower = upper = -1
+        for node_index in reversed(path):
+            if key <= keys[node_index]:
+                upper = self._link(upper, node_index, self.right[node_index])
+            else:
+                lower = self._link(self.left[node_index], node_index, lower)
+        return lower, upper
+
+    def _concat(self, left, right):
+        # Join two subtrees without a middle key, borrowing the smallest node of right
+        if left == -1:
+            return right
+        if right == -1:
+            return left
+        node_index, right = self._pop_first(right)
+        return self._link(left, node_index, right)
+
+    def _pop_first(self, node_index):
+        # Detach the smallest node of a subtree, returns (node, remaining subtree)
+        path = []
+        while self.left[node_index] != -1:
+            path.append(node_index)
+            node_index = self.left[node_index]
+        occurrences = self.counts[node_index] if self.counts is not None else 1
+        return node_index, self._retrace(path, node_index, self.right[node_index], -occurrences)
+
+    def _take_first(self, node_index, key):
+        # Detach the smallest node of a subtree if it holds key, returns (node or -1, subtree)
+        first = node_index
+        while first != -1 and self.left[first] != -1:
+            first = self.left[first]
+        if first == -1 or self.keys[first] != key:
+            return -1, node_index
+        return self._pop_first(node_index)
+
+    def _drop(self, node_index):
+        # Release a detached node and forget its occurrences
+        occurrences = self.counts[node_index] if self.counts is not None else 1
+        if self.tombstone_threshold is not None and not occurrences:
+            self.tombstones -= 1
+        self.length -= occurrences
+        self._release(node_index)
+
+    def _discard(self, node_index):
+        # Release a whole detached subtree
+        stack = [node_index] if node_index != -1 else []
+        while stack:
+            node_index = stack.pop()
+            for child in (self.left[node_index], self.right[node_index]):
+                if child != -1:
+                    stack.append(child)
+            self._drop(node_index)
+
+    def _adopt(self, other):
+        # Copy the keys (and values) of another tree into fresh slots of this arena as a
+        # balanced subtree, with the tree's length growing accordingly, and return its root
+        self._forget_all()
+        keys = self._new_store(self.key_typecode, other)
+        values = None
+        if self.values is not None and getattr(other, "values", None) is not None:
+            values = [value for _, value in other.items()]
+        counts = None
+        if self.multiset:
+            keys, counts = self._group_runs(keys)
+        slots = [self._allocate() for _ in range(len(keys))]
+        for position, node_index in enumerate(slots):
+            self.keys[node_index] = keys[position]
+            if self.values is not None:
+                self.values[node_index] = values[position] if values is not None else self._fill(self.value_typecode)
+            if self.counts is not None:
+                self.counts[node_index] = counts[position] if counts is not None else 1
+        self.length += len(keys) if counts is None else sum(counts)
+        return self._build_balanced(0, len(slots), slots)
+
+    def _move_to(self, node_index, other):
+        # Copy a detached subtree into the empty tree other and release it here
+        nodes = list(self._range_nodes(root=node_index))
+        other._load_sorted([self.keys[i] for i in nodes],
+                           None if self.values is None else [self.values[i] for i in nodes],
+                           None if self.counts is None else array.array('I', [self.counts[i] for i in nodes]))
+        self._discard(node_index)
+
+    def _spawn(self):
+        # Empty tree with the same options
+        return type(self)(capacity=0, order_stats=self.sizes is not None, key_typecode=self.key_typecode,
+                          value_typecode=self.value_typecode, compact_threshold=self.compact_threshold,
+                          compact_layout=self.compact_layout, multiset=self.multiset,
+                          tombstone_threshold=self.tombstone_threshold, search_cache=self.search_cache,
+                          finger_search=self.finger_search)
+
+    def _compatible(self, other):
+        return (isinstance(other, ArrayAVLTree) and other._stores() == self._stores()
+                and other.multiset == self.multiset
+                and (other.tombstone_threshold is None) == (self.tombstone_threshold is None))
+
+    def _swap_arenas(self, other):
+        # Exchange the stored nodes of two trees with the same options
+        self._forget_all()
+        other._forget_all()
+        for name in [name for name, _ in self._stores()] + [
+                "capacity", "size", "node_count", "length", "root", "free_head", "tombstones",
+                "read_only", "_mapping"]:
+            mine = getattr(self, name)
+            setattr(self, name, getattr(other, name))
+            setattr(other, name, mine)
+
+    def __iter__(self):
+        return self.range()
+
+    def range(self, lo=None, hi=None, reverse=False):
+        keys = self.keys
+        if self.counts is None:
+            return (keys[node_index] for node_index in self._range_nodes(lo, hi, reverse))
+        counts = self.counts
+        return (keys[node_index] for node_index in self._range_nodes(lo, hi, reverse)
+                for _ in range(counts[node_index]))
+
+    def items(self, lo=None, hi=None, reverse=False):
+        values = self._require_values()
+        keys = self.keys
+        return ((keys[node_index], values[node_index]) for node_index in self._live_nodes(lo, hi, reverse))
+
+    def _live_nodes(self, lo=None, hi=None, reverse=False):
+        # _range_nodes without the tombstones
+        if self.tombstone_threshold is None:
+            return self._range_nodes(lo, hi, reverse)
+        counts = self.counts
+        return (node_index for node_index in self._range_nodes(lo, hi, reverse) if counts[node_index])
+
+    def _range_nodes(self, lo=None, hi=None, reverse=False, root=None):
+        # Lazily yield the nodes with keys in [lo, hi) in order, skipping subtrees outside the bounds.
+        # Only the current root-to-node path is kept on the stack. root defaults to the tree root.
+        keys = self.keys
+        left = self.left
+        right = self.right
+        stack = []
+        node_index = self.root if root is None else root
+
+        if not reverse:
+            while True:
+                while node_index != -1:
+                    if lo is not None and keys[node_index] < lo:
+                        node_index = right[node_index]
+                    else:
+                        stack.append(node_index)
+                        node_index = left[node_index]
+                if not stack:
+                    return
+                node_index = stack.pop()
+                if hi is not None and keys[node_index] >= hi:
+                    return
+                yield node_index
+                node_index = right[node_index]
+        else:
+            while True:
+                while node_index != -1:
+                    if hi is not None and keys[node_index] >= hi:
+                        node_index = left[node_index]
+                    else:
+                        stack.append(node_index)
+                        node_index = right[node_index]
+                if not stack:
+                    return
+                node_index = stack.pop()
+                if lo is not None and keys[node_index] < lo:
+                    return
+                yield node_index
+                node_index = left[node_index]
+
+    def floor(self, key):
+        return self._below(key, True)
+
+    def ceiling(self, key):
+        return self._above(key, True)
+
+    def predecessor(self, key):
+        return self._below(key, False)
+
+    def successor(self, key):
+        return self._above(key, False)
+
+    def _below(self, key, inclusive):
+        # Largest stored key < key (or <= key when inclusive), None if there is none
+        if self.tombstones:
+            # The best candidate of the descent may be dead, so walk back to the first live key
+            if inclusive and self._find_live(key) is not None:
+                return key
+            for node_index in self._live_nodes(hi=key, reverse=True):
+                return self.keys[node_index]
+            return None
+        keys = self.keys
+        best = None
+        node_index = self.root
+        while node_index != -1:
+            node_key = keys[node_index]
+            if node_key < key or (inclusive and node_key == key):
+                best = node_key
+                node_index = self.right[node_index]
+            else:
+                node_index = self.left[node_index]
+        return best
+
+    def _above(self, key, inclusive):
+        # Smallest stored key > key (or >= key when inclusive), None if there is none
+        if self.tombstones:
+            for node_index in self._live_nodes(key):
+                if inclusive or self.keys[node_index] != key:
+                    return self.keys[node_index]
+            return None
+        keys = self.keys
+        best = None
+        node_index = self.root
+        while node_index != -1:
+            node_key = keys[node_index]
+            if node_key > key or (inclusive and node_key == key):
+                best = node_key
+                node_index = self.left[node_index]
+            else:
+                node_index = self.right[node_index]
+        return best
+
+    def rank(self, key):
+        # Number of stored keys strictly less than key
+        sizes = self._require_sizes()
+        keys = self.keys
+        rank = 0
+        node_index = self.root
+        while node_index != -1:
+            if key <= keys[node_index]:
+                node_index = self.left[node_index]
+            else:
+                left_child = self.left[node_index]
+                occurrences = self.counts[node_index] if self.counts is not None else 1
+                rank += occurrences + (sizes[left_child] if left_child != -1 else 0)
+                node_index = self.right[node_index]
+        return rank
+
+    def select(self, k):
+        # The k-th smallest key, counting from 0
+        sizes = self._require_sizes()
+        if k < 0 or k >= self.length:
+            raise IndexError("select index out of range")
+        node_index = self.root
+        while True:
+            left_child = self.left[node_index]
+            left_size = sizes[left_child] if left_child != -1 else 0
+            occurrences = self.counts[node_index] if self.counts is not None else 1
+            if k < left_size:
+                node_index = left_child
+            elif k < left_size + occurrences:
+                return self.keys[node_index]
+            else:
+                k -= left_size + occurrences
+                node_index = self.right[node_index]
+
+    def count_range(self, lo, hi):
+        # Number of stored keys in [lo, hi)
+        if hi <= lo:
+            return 0
+        return self.rank(hi) - self.rank(lo)
+
+    def _require_sizes(self):
+        if self.sizes is None:
+            raise ValueError("Order statistics are not enabled, create the tree with order_stats=True")
+        return self.sizes
+
+    def _update_size(self, node_index):
+        sizes = self.sizes
+        left_child = self.left[node_index]
+        right_child = self.right[node_index]
+        occurrences = self.counts[node_index] if self.counts is not None else 1
+        sizes[node_index] = (occurrences + (sizes[left_child] if left_child != -1 else 0)
+                             + (sizes[right_child] if right_child != -1 else 0))
+
+    def compact(self, layout="bfs"):
+        # Rewrite the live nodes into slots 0..node_count-1 in a locality friendly order and drop
+        # the dead slots. "bfs" stores the tree level by level, "veb" in van Emde Boas order
+        # (recursive top/bottom halves), "inorder" in key order. Tombstones are purged first.
+        self._require_writable()
+        if self.tombstones:
+            self.purge()
+        if layout == "bfs":
+            order = self._bfs_order()
+        elif layout == "veb":
+            order = []
+            if self.root != -1:
+                self._veb_order(self.root, self.heights[self.root], order)
+        elif layout == "inorder":
+            order = list(self._range_nodes())
+        else:
+            raise ValueError(f"Unknown layout: {layout}")
+
+        new_index = array.array('i', [-1]) * self.size
+        for position, node_index in enumerate(order):
+            new_index[node_index] = position
+
+        for name, typecode in self._stores():
+            store = getattr(self, name)
+            if name in ("left", "right"):
+                items = [new_index[store[i]] if store[i] != -1 else -1 for i in order]
+            else:
+                items = [store[i] for i in order]
+            setattr(self, name, self._new_store(typecode, items))
+        self._mapping = None
+
+        self.root = new_index[self.root] if self.root != -1 else -1
+        self.capacity = self.size = self.node_count = len(order)
+        self.free_head = -1
+        self._forget_all()
+
+    def fragmentation(self):
+        # Fraction of the handed out slots that are dead
+        if self.size == 0:
+            return 0.0
+        return (self.size - self.node_count) / self.size
+
+    def _maybe_compact(self):
+        if self.compact_threshold is not None and self.size >= 64 \
+                and self.fragmentation() > self.compact_threshold:
+            self.compact(self.compact_layout)
+
+    def _bfs_order(self):
+        order = []
+        if self.root != -1:
+            order.append(self.root)
+        for node_index in order:
+            if self.left[node_index] != -1:
+                order.append(self.left[node_index])
+            if self.right[node_index] != -1:
+                order.append(self.right[node_index])
+        return order
+
+    def _veb_order(self, node_index, height, order):
+        if height == 1:
+            order.append(node_index)
+            return
+        # Lay out the top half of the levels first, then each subtree hanging below it
+        top_height = height // 2
+        self._veb_order(node_index, top_height, order)
+        frontier = [node_index]
+        for _ in range(top_height):
+            frontier = [child for parent in frontier
+                        for child in (self.left[parent], self.right[parent]) if child != -1]
+        for child in frontier:
+            self._veb_order(child, height - top_height, order)
+
+    def save(self, path):
+        # Write a versioned binary file: preamble, JSON header, then the raw buffer of every
+        # per-node store truncated to the slots handed out so far
+        sections = []
+        buffers = []
+        offset = 0
+        for name, typecode in self._stores():
+            if typecode == OBJECT_TYPECODE:
+                raise TypeError(f"Cannot save the {name} store, it holds Python objects")
+            buffer = memoryview(getattr(self, name))[:self.size]
+            sections.append({"name": name, "typecode": typecode, "itemsize": buffer.itemsize,
+                             "offset": offset, "length": len(buffer)})
+            buffers.append(buffer)
+            offset += _align(buffer.nbytes)
+
+        header = json.dumps({
+            "byteorder": sys.byteorder,
+            "size": self.size,
+            "count": self.node_count,
+            "length": self.length,
+            "multiset": self.multiset,
+            "tombstone_threshold": self.tombstone_threshold,
+            "tombstones": self.tombstones,
+            "root": self.root,
+            "free_head": self.free_head,
+            "order_stats": self.sizes is not None,
+            "key_typecode": self.key_typecode,
+            "value_typecode": self.value_typecode,
+            "compact_threshold": self.compact_threshold,
+            "compact_layout": self.compact_layout,
+            "sections": sections,
+        }).encode("utf-8")
+
+        with open(path, "wb") as f:
+            f.write(_PREAMBLE.pack(FILE_MAGIC, FILE_VERSION, len(header)))
+            f.write(header)
+            f.write(bytes(_align(_PREAMBLE.size + len(header)) - _PREAMBLE.size - len(header)))
+            for buffer in buffers:
+                f.write(buffer)
+                f.write(bytes(_align(buffer.nbytes) - buffer.nbytes))
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        # Memory-map a file written by save(). The stores become views over the mapped pages,
+        # so nothing is copied and several processes share the page cache. Mode "r" is
+        # read-only, mode "c" allows private copy-on-write updates that never reach the file.
+        if mode == "r":
+            access = mmap.ACCESS_READ
+        elif mode == "c":
+            access = mmap.ACCESS_COPY
+        else:
+            raise ValueError(f"Unsupported mode: {mode}")
+
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=access)
+
+        magic, version, header_length = _PREAMBLE.unpack_from(mapping)
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not an ArrayAVLTree file")
+        if version != FILE_VERSION:
+            raise ValueError(f"Unsupported file version {version}, expected {FILE_VERSION}")
+        header = json.loads(bytes(mapping[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written on a {header['byteorder']}-endian machine")
+
+        tree = cls(capacity=0, order_stats=header["order_stats"],
+                   key_typecode=header["key_typecode"], value_typecode=header["value_typecode"],
+                   compact_threshold=header["compact_threshold"], compact_layout=header["compact_layout"],
+                   multiset=header.get("multiset", False),
+                   tombstone_threshold=header.get("tombstone_threshold"))
+        view = memoryview(mapping)
+        data_start = _align(_PREAMBLE.size + header_length)
+        for section in header["sections"]:
+            if array.array(section["typecode"]).itemsize != section["itemsize"]:
+                raise ValueError(f"Item size of the {section['name']} store does not match this platform")
+            start = data_start + section["offset"]
+            end = start + section["length"] * section["itemsize"]
+            setattr(tree, section["name"], view[start:end].cast(section["typecode"]))
+
+        tree.capacity = tree.size = header["size"]
+        tree.node_count = header["count"]
+        tree.length = header.get("length", header["count"])
+        tree.tombstones = header.get("tombstones", 0)
+        tree.root = header["root"]
+        tree.free_head = header["free_head"]
+        tree.read_only = mode == "r"
+        tree._mapping = mapping
+        return tree
+
+    def _materialize(self):
+        # Copy memory-mapped stores into growable arrays, after which the file is no longer used
+        for name, typecode in self._stores():
+            store = getattr(self, name)
+            if isinstance(store, memoryview):
+                copy = array.array(typecode)
+                copy.frombytes(store.cast('B'))
+                setattr(self, name, copy)
+        self._mapping = None
+
+    def memory_footprint(self):
+        # Exact bytes held by the per-node stores, split into live slots, dead slots waiting
+        # on the free list and spare capacity (including what array.extend over-allocates).
+        # Keys and values kept in object stores also count the objects they point to.
+        slot_bytes = 0
+        allocated_bytes = 0
+        overhead_bytes = sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+        for name, typecode in self._stores():
+            store = getattr(self, name)
+            if isinstance(store, memoryview):
+                # Mapped file pages, there is no header and nothing over-allocated
+                slot_bytes += store.itemsize
+                allocated_bytes += store.nbytes
+                continue
+            empty = [] if typecode == OBJECT_TYPECODE else array.array(typecode)
+            item_bytes = struct.calcsize('P') if typecode == OBJECT_TYPECODE else empty.itemsize
+            slot_bytes += item_bytes
+            allocated_bytes += sys.getsizeof(store) - sys.getsizeof(empty)
+            overhead_bytes += sys.getsizeof(empty)
+
+        # Tombstones are dead slots that have not been reclaimed yet
+        live_nodes = self.node_count - self.tombstones
+        live_bytes = live_nodes * slot_bytes
+        for name, typecode in self._stores():
+            if typecode == OBJECT_TYPECODE:
+                store = getattr(self, name)
+                live_bytes += sum(sys.getsizeof(store[i]) for i in self._live_nodes())
+        dead_bytes = (self.size - live_nodes) * slot_bytes
+        spare_bytes = allocated_bytes - self.size * slot_bytes
+        total_bytes = live_bytes + dead_bytes + spare_bytes + overhead_bytes
+        return {
+            "keys": self.length,
+            "live_bytes": live_bytes,
+            "dead_bytes": dead_bytes,
+            "spare_bytes": spare_bytes,
+            "overhead_bytes": overhead_bytes,
+            "total_bytes": total_bytes,
+            "bytes_per_key": total_bytes / self.length if self.length else 0.0,
+        }
 
     def _get_height(self, node_index):
         if node_index == -1:
@@ -136,6 +1454,10 @@ class ArrayAVLTree:
         self.heights[z] = 1 + max(self._get_height(self.left[z]), self._get_height(self.right[z]))
         self.heights[y] = 1 + max(self._get_height(self.left[y]), self._get_height(self.right[y]))
 
+        if self.sizes is not None:
+            self._update_size(z)
+            self._update_size(y)
+
         return y
 
     def _right_rotate(self, z):
@@ -148,6 +1470,10 @@ class ArrayAVLTree:
         self.heights[z] = 1 + max(self._get_height(self.left[z]), self._get_height(self.right[z]))
         self.heights[y] = 1 + max(self._get_height(self.left[y]), self._get_height(self.right[y]))
 
+        if self.sizes is not None:
+            self._update_size(z)
+            self._update_size(y)
+
         return y
 
     def _get_min_value_node(self, node_index):
@@ -155,3 +1481,114 @@ class ArrayAVLTree:
         while self.left[current] != -1:
             current = self.left[current]
         return current
+
+
+class CountingArrayAVLTree(ArrayAVLTree):
+    # Instrumented engine that tallies the work behind every operation in self.counters. All
+    # of the counting lives in these overrides, so a plain ArrayAVLTree pays nothing for it.
+    # Comparisons and visited nodes come from tracing each descent the way the engine walks
+    # it; the climbs of finger search and the detours past tombstones are not traced.
+    COUNTERS = ("comparisons", "nodes_visited", "rotations_ll", "rotations_lr", "rotations_rr",
+                "rotations_rl", "retraces", "retrace_depth", "allocations")
+
+    def __init__(self, *args, **kwargs):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        super().__init__(*args, **kwargs)
+
+    def reset_counters(self):
+        # Zero every counter and return the tallies gathered so far
+        counters = self.counters
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        return counters
+
+    def height_stats(self):
+        # Height of the tree and the mean depth of its nodes (the root is at depth 1), which is
+        # the number of nodes a successful search visits on average
+        total_depth = 0
+        nodes = 0
+        stack = [(self.root, 1)] if self.root != -1 else []
+        while stack:
+            node_index, depth = stack.pop()
+            total_depth += depth
+            nodes += 1
+            for child in (self.left[node_index], self.right[node_index]):
+                if child != -1:
+                    stack.append((child, depth + 1))
+        return {
+            "max_height": self._get_height(self.root),
+            "average_height": total_depth / nodes if nodes else 0.0,
+        }
+
+    def _trace(self, node_index, key, stop):
+        # Count the descent for key: one equality test per node, plus an ordering test at each
+        # node the walk passes through. Stops at an equal key only where stop(node) says the
+        # engine does.
+        counters = self.counters
+        keys = self.keys
+        while node_index != -1:
+            counters["nodes_visited"] += 1
+            counters["comparisons"] += 1
+            if keys[node_index] == key and stop(node_index):
+                return node_index
+            counters["comparisons"] += 1
+            node_index = self.left[node_index] if key < keys[node_index] else self.right[node_index]
+        return -1
+
+    def _search(self, node_index, key):
+        self._trace(node_index, key, lambda node: True)
+        return super()._search(node_index, key)
+
+    def _find_live(self, key):
+        self._trace(self.root, key, lambda node: self.counts[node] > 0)
+        return super()._find_live(key)
+
+    def _insert(self, node_index, key, value=None, replace=False):
+        lazy = self.tombstone_threshold is not None
+        found = self._trace(node_index, key, lambda node: (lazy and not self.counts[node]) or replace
+                            or self.multiset)
+        if found == -1 and node_index != -1:
+            # Linking the new node to its parent compares against the parent once more
+            self.counters["comparisons"] += 1
+        return super()._insert(node_index, key, value, replace)
+
+    def _delete(self, node_index, key, remove_all=False):
+        found = self._trace(node_index, key, lambda node: True)
+        if found != -1 and self.left[found] != -1 and self.right[found] != -1 and (
+                self.counts is None or self.counts[found] <= 1 or remove_all):
+            # Walk down to the inorder successor that gets unlinked instead
+            successor = self.right[found]
+            self.counters["nodes_visited"] += 1
+            while self.left[successor] != -1:
+                successor = self.left[successor]
+                self.counters["nodes_visited"] += 1
+        return super()._delete(node_index, key, remove_all)
+
+    def _retrace(self, path, old_child, child, delta):
+        self.counters["retraces"] += 1
+        return super()._retrace(path, old_child, child, delta)
+
+    def _rebalance(self, node_index):
+        # Every level a retrace climbs is one rebalance call
+        counters = self.counters
+        counters["retrace_depth"] += 1
+        left_child = self.left[node_index]
+        right_child = self.right[node_index]
+        balance = self._get_height(left_child) - self._get_height(right_child)
+        if balance > 1:
+            counters["rotations_ll" if self._get_balance(left_child) >= 0 else "rotations_lr"] += 1
+        elif balance < -1:
+            counters["rotations_rr" if self._get_balance(right_child) <= 0 else "rotations_rl"] += 1
+        return super()._rebalance(node_index)
+
+    def _allocate(self):
+        self.counters["allocations"] += 1
+        return super()._allocate()
+
+    def _load_sorted(self, keys, values=None, counts=None):
+        # A bulk load hands out every slot of the rebuilt tree at once
+        super()._load_sorted(keys, values, counts)
+        self.counters["allocations"] += self.node_count
+
+
+def _align(offset):
+    return (offset + 7) & ~7
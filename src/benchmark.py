@@ -1,241 +1,489 @@
+import argparse
+import array
+import csv
+import datetime
+import gc
+import gzip
+import json
+import multiprocessing
+import platform
 import time
+import tracemalloc
 import cProfile
 import pstats
 import io
-from memory_profiler import memory_usage
-from reference_avl_tree import AVLTreeReference
-from array_avl_tree import ArrayAVLTree
-import graphviz
+import struct
+from reference_avl_tree import AVLTreeReference, CountingAVLTreeReference
+from array_avl_tree import ArrayAVLTree, CountingArrayAVLTree
+from bplus_tree import BPlusTree
+from visualize_tree import DEFAULT_OUTPUT_DIR, Visualizer
+from workload import read_trace, replay
 import os
-import subprocess
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DATASETS = [os.path.join(ROOT_DIR, "datasets", f"dataset_{name}.txt") for name in ("small", "medium", "large")]
+RESULTS_FILE = os.path.join(ROOT_DIR, "result", "benchmark_results.jsonl")
+PROFILE_FILE = os.path.join(ROOT_DIR, "result", "profiling_stats.txt")
+WORKLOAD_RESULTS_FILE = os.path.join(ROOT_DIR, "result", "workload_results.txt")
+OPERATIONS = ["insert", "search", "delete"]
+
+# Columns of every result record. One record holds one sample: "time" is seconds per
+# operation, "memory" and "peak_memory" are MB for the whole batch. With --counters every
+# work counter of the instrumented engines (comparisons, nodes_visited, rotations_ll, ...) is
+# one more metric, averaged per operation, next to the max_height and average_height of the
+# resulting tree.
+RESULT_FIELDS = ["engine", "dataset", "size", "operation", "repetition", "metric", "value",
+                 "run", "host", "python", "platform", "cpus"]
+METRICS = {"times": "time", "memory": "memory", "peak_memory": "peak_memory"}
+
+# Binary dataset header, must match datasets/generate_datasets.py
+DATASET_MAGIC = b"AVLKEYS\0"
+DATASET_HEADER = struct.Struct("<8sI4sQ")
 
 def load_dataset(file_path):
     """
     Load the dataset from a file.
-    Each line in the file represents an integer to insert into the AVL tree.
-    """
-    with open(file_path, "r") as f:
-        return [int(line.strip()) for line in f.readlines()]
-
-def visualize_tree(tree, tree_type="Reference", operation="Visualization", search_key=None):
-    """
-    Visualize the AVL tree using Graphviz, with labels for operation and tree type.
-    Highlight the path to the search_key if provided.
-    """
-    dot = graphviz.Digraph(comment='AVL Tree', format='png')
-
-    # Add a title to the graph with operation (insert, delete, search) and tree type
-    dot.attr(label=f"AVL Tree - {tree_type} | Operation: {operation}", labelloc="t", fontsize="20")
-
-    if tree_type == "Reference":
-        # Handle reference-based AVL tree visualization
-        def add_edges(node, parent=None, path=None):
-            if node is not None:
-                node_id = str(node.key)
-                if path and node.key in path:
-                    dot.node(node_id, label=str(node.key), color="red", style="filled", fillcolor="lightpink")
-                else:
-                    dot.node(node_id, label=str(node.key))
-
-                if parent:
-                    if path and node.key in path and parent in path:
-                        dot.edge(parent, node_id, color="red", penwidth="2.0")
-                    else:
-                        dot.edge(parent, node_id)
-
-                add_edges(node.left, parent=node_id, path=path)
-                add_edges(node.right, parent=node_id, path=path)
-
-        # If it's a search operation and search_key is provided, find the path
-        path = []
-        if operation == "search" and search_key is not None:
-            current = tree.root
-            while current:
-                path.append(current.key)
-                if search_key == current.key:
-                    break
-                elif search_key < current.key:
-                    current = current.left
-                else:
-                    current = current.right
-
-        add_edges(tree.root, path=path)  # Start visualizing from the root
-
-    elif tree_type == "Array":
-        # Handle array-based AVL tree visualization
-        def add_edges_from_array(index=0, parent=None, path=None):
-            if index >= tree.size or index == -1:
-                return
-            node_id = str(tree.keys[index])
-            if path and tree.keys[index] in path:
-                dot.node(node_id, label=str(tree.keys[index]), color="red", style="filled", fillcolor="lightpink")
-            else:
-                dot.node(node_id, label=str(tree.keys[index]))
-
-            if parent:
-                if path and tree.keys[index] in path and parent in path:
-                    dot.edge(parent, node_id, color="red", penwidth="2.0")
-                else:
-                    dot.edge(parent, node_id)
-
-            add_edges_from_array(tree.left[index], node_id, path)
-            add_edges_from_array(tree.right[index], node_id, path)
-
-        # If it's a search operation and search_key is provided, find the path
-        path = []
-        if operation == "search" and search_key is not None:
-            current = tree.root
-            while current != -1 and current < tree.size:
-                path.append(tree.keys[current])
-                if search_key == tree.keys[current]:
-                    break
-                elif search_key < tree.keys[current]:
-                    current = tree.left[current]
-                else:
-                    current = tree.right[current]
-
-        add_edges_from_array(tree.root, path=path)
-
-    # Ensure the output directory exists
-    output_dir = r"C:\Users\brike\Desktop\Algoritma\visual"
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Generate a unique filename with tree type, operation, and database size
-    output_path = get_unique_filename(output_dir, tree_type, operation, ".png")
-
-    # Render the visualization to the specified file path (without the extension, as Graphviz will append '.png')
-    render_with_timeout(dot, output_path)
-
-def get_unique_filename(folder, tree_type, operation, extension):
-    """
-    Generate a unique filename in the specified folder with tree type, operation, and database size.
-    """
-    counter = 1
-    while True:
-        filename = f"{tree_type}_{operation}_{counter}{extension}"
-        full_path = os.path.join(folder, filename)
-        if not os.path.exists(full_path):
-            return full_path
-        counter += 1
-
-def render_with_timeout(dot, output_path, timeout=60):
+    Binary datasets (see datasets/generate_datasets.py) are read straight into an array;
+    otherwise each line in the file represents an integer to insert into the AVL tree.
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(DATASET_HEADER.size)
+        if header.startswith(DATASET_MAGIC) and len(header) == DATASET_HEADER.size:
+            _, version, typecode, count = DATASET_HEADER.unpack(header)
+            if version != 1:
+                raise ValueError(f"Unsupported dataset version {version} in {file_path}")
+            keys = array.array(typecode.rstrip(b"\0").decode("ascii"))
+            keys.fromfile(f, count)
+            return keys
+        f.seek(0)
+        return [int(line) for line in f if line.strip()]
+
+def reference_insert(tree, keys):
+    insert = tree.insert
+    root = tree.root
+    for key in keys:
+        root = insert(root, key)
+    tree.root = root
+
+def reference_search(tree, keys):
+    search = tree.search
+    root = tree.root
+    for key in keys:
+        search(root, key)
+
+def reference_delete(tree, keys):
+    delete = tree.delete
+    root = tree.root
+    for key in keys:
+        root = delete(root, key)
+    tree.root = root
+
+def array_insert(tree, keys):
+    insert = tree.insert
+    for key in keys:
+        insert(key)
+
+def array_search(tree, keys):
+    search = tree.search
+    for key in keys:
+        search(key)
+
+def array_delete(tree, keys):
+    delete = tree.delete
+    for key in keys:
+        delete(key)
+
+# Every engine the benchmark can drive: how to create an empty tree and how to apply
+# each operation to a whole batch of keys, one key at a time. Engines with work counters
+# also name their instrumented variant.
+ENGINES = {
+    "ReferenceAVL": {
+        "factory": AVLTreeReference,
+        "counting_factory": CountingAVLTreeReference,
+        "insert": reference_insert,
+        "search": reference_search,
+        "delete": reference_delete,
+    },
+    "ArrayAVL": {
+        "factory": ArrayAVLTree,
+        "counting_factory": CountingArrayAVLTree,
+        "insert": array_insert,
+        "search": array_search,
+        "delete": array_delete,
+    },
+    # Same insert/search/delete surface as the array-based AVL tree
+    "BPlusTree": {
+        "factory": BPlusTree,
+        "insert": array_insert,
+        "search": array_search,
+        "delete": array_delete,
+    },
+}
+
+def prepare_tree(engine, operation, dataset, factory="factory"):
+    """
+    Build the starting tree for an operation outside any measured region:
+    an empty tree for insert, a tree holding the whole dataset for search and delete.
+    """
+    tree = engine[factory]()
+    if operation != "insert":
+        engine["insert"](tree, dataset)
+    return tree
+
+def time_operation(engine, operation, dataset, repeats=5, warmup=1):
+    """
+    Time one operation applied to the whole dataset as a single batch with perf_counter_ns.
+    Each run starts from a freshly prepared tree and runs with the garbage collector paused;
+    the first `warmup` runs are discarded. Returns the batch time in nanoseconds of every
+    measured run.
+    """
+    run_operation = engine[operation]
+    timings = []
+    for run in range(warmup + repeats):
+        tree = prepare_tree(engine, operation, dataset)
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter_ns()
+            run_operation(tree, dataset)
+            elapsed = time.perf_counter_ns() - start
+        finally:
+            gc.enable()
+        if run >= warmup:
+            timings.append(elapsed)
+    return timings
+
+def measure_memory(engine, operation, dataset):
+    """
+    Measure the memory an operation allocates with tracemalloc, separately from timing.
+    Tracing starts before the tree is prepared so frees of existing nodes are seen too.
+    Returns the net change between the snapshots taken around the operation and the
+    peak above the starting point, both in bytes, plus the resulting tree.
+    """
+    gc.collect()
+    tracemalloc.start()
     try:
-        # Render using Graphviz
-        dot.render(output_path[:-4], format='png', cleanup=True)
-        print(f"Tree visualization saved at {output_path}")
-    except subprocess.TimeoutExpired:
-        print("Rendering timed out.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error in rendering: {e}")
-
-def profile_operation(tree, dataset, operation, key=10, is_reference=False):
-    """
-    Profile a given operation (insert, search, delete) for the given tree.
-    The search and delete operations are specifically performed for the provided key (default is 10).
-    """
-    times = []
-    mem_usage = []
-
-    for data_key in dataset:
-        start_time = time.perf_counter()
-        mem_start = memory_usage(-1, interval=0.01, timeout=1)
-
-        if operation == "insert":
-            if is_reference:
-                tree.root = tree.insert(tree.root, data_key)
-            else:
-                tree.insert(data_key)
-        elif operation == "search":
-            if key and hasattr(tree, 'search'):
-                if is_reference:
-                    tree.search(tree.root, key)
-                else:
-                    tree.search(key)
-        elif operation == "delete":
-            if data_key == key:
-                if is_reference:
-                    tree.root = tree.delete(tree.root, key)
-                else:
-                    tree.delete(key)
-
-        mem_end = memory_usage(-1, interval=0.1, timeout=1)
-        operation_time = time.perf_counter() - start_time
-
-        times.append(operation_time)
-        mem_usage.append(mem_end[0] - mem_start[0])
-
-    return times, mem_usage
-
-def benchmark_operations_with_profiling(tree, dataset, is_reference=False):
-    """
-    Benchmark operations (insert, search, delete) with profiling for the given tree.
+        tree = prepare_tree(engine, operation, dataset)
+        before = tracemalloc.take_snapshot()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        engine[operation](tree, dataset)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    # Filter only once both snapshots exist, filtering allocates (and caches) memory itself
+    ignore_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before = before.filter_traces(ignore_tracemalloc)
+    after = after.filter_traces(ignore_tracemalloc)
+    net_bytes = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return net_bytes, peak_bytes - start_bytes, tree
+
+def count_operation(engine, operation, dataset):
+    """
+    Replay an operation on the instrumented variant of an engine in an extra, untimed run.
+    Returns the work counters averaged per operation, plus the height and average node
+    depth of the resulting tree.
     """
+    tree = prepare_tree(engine, operation, dataset, factory="counting_factory")
+    tree.reset_counters()
+    engine[operation](tree, dataset)
+    size = max(len(dataset), 1)
+    counters = {name: value / size for name, value in tree.reset_counters().items()}
+    counters.update(tree.height_stats())
+    return counters
+
+def benchmark_operations(engine_name, dataset, repeats=5, warmup=1, visualizer=None, counters=False):
+    """
+    Benchmark insert, search and delete of every dataset key for one engine.
+    Per-operation times are the batch totals divided by the dataset size.
+    The tree after each operation is handed to `visualizer`, if given. With `counters`,
+    the work counters of engines that have an instrumented variant are recorded too.
+    """
+    engine = ENGINES[engine_name]
     results = {}
-    tree_type = "Reference" if is_reference else "Array"
-    for operation in ["insert", "search", "delete"]:
-        print(f"Profiling {operation} operation for {tree_type}-based AVL Tree...")
-        times, mem_usage = profile_operation(tree, dataset, operation, key=10, is_reference=is_reference)
+    for operation in OPERATIONS:
+        print(f"Benchmarking {operation} operation for {engine_name}...")
+        timings = time_operation(engine, operation, dataset, repeats, warmup)
+        net_bytes, peak_bytes, tree = measure_memory(engine, operation, dataset)
         results[operation] = {
-            "times": times,
-            "memory": mem_usage
+            "size": len(dataset),
+            "times": [elapsed / 1e9 / max(len(dataset), 1) for elapsed in timings],
+            "memory": [net_bytes / 2 ** 20],
+            "peak_memory": [peak_bytes / 2 ** 20],
         }
-        
+        if counters and "counting_factory" in engine:
+            results[operation]["counters"] = count_operation(engine, operation, dataset)
+
         # Visualize the tree after each operation
-        search_key = 10 if operation == "search" else None
-        visualize_tree(tree, tree_type=tree_type, operation=operation, search_key=search_key)
+        if visualizer is not None:
+            search_key = 10 if operation == "search" else None
+            visualizer.submit(tree, engine_name, operation, search_key)
 
     return results
 
-def run_benchmarks_with_profiling():
+def run_benchmarks(datasets=DATASETS, engines=tuple(ENGINES), repeats=5, warmup=1,
+                   visualizer=None, results_file=RESULTS_FILE, counters=False):
     """
-    Run the benchmarks with detailed profiling for different dataset sizes and tree types.
+    Run the benchmarks for every dataset and engine and save the results.
     """
-    datasets = ["../datasets/dataset_small.txt", "../datasets/dataset_medium.txt", "../datasets/dataset_large.txt"]
-    results = {"ReferenceAVL": [], "ArrayAVL": []}
+    results = {engine_name: [] for engine_name in engines}
 
     for dataset_path in datasets:
         dataset = load_dataset(dataset_path)
+        for engine_name in engines:
+            print(f"Benchmarking {engine_name} with dataset: {dataset_path}")
+            engine_results = benchmark_operations(engine_name, dataset, repeats, warmup, visualizer, counters)
+            results[engine_name].append(engine_results)
 
-        # Reference-based AVL Tree profiling
-        ref_avl = AVLTreeReference()
-        print(f"Benchmarking Reference-based AVL Tree with dataset: {dataset_path}")
-        ref_results = benchmark_operations_with_profiling(ref_avl, dataset, is_reference=True)
-        results["ReferenceAVL"].append(ref_results)
-
-        # Array-based AVL Tree profiling
-        array_avl = ArrayAVLTree()
-        print(f"Benchmarking Array-based AVL Tree with dataset: {dataset_path}")
-        array_results = benchmark_operations_with_profiling(array_avl, dataset)
-        results["ArrayAVL"].append(array_results)
-
-    # Save results to a file
-    with open("../result/benchmark_results.txt", "w") as f:
-        for tree_type, tree_results in results.items():
-            for idx, dataset_results in enumerate(tree_results):
-                dataset_name = datasets[idx].split("/")[-1]  # Get dataset name
-                f.write(f"{tree_type} - Dataset: {dataset_name}\n")
-                for operation, data in dataset_results.items():
-                    f.write(f"{operation.capitalize()} Operation:\n")
-                    f.write(f"  Times: {data['times']}\n")
-                    f.write(f"  Memory Usage: {data['memory']}\n\n")
-
+    save_results(results, datasets, results_file)
     return results
 
-if __name__ == "__main__":
-    profiler = cProfile.Profile()
-    profiler.enable()
+def environment():
+    """
+    Metadata stamped on every result record, so samples from different runs and machines
+    can be told apart after their files have been concatenated.
+    """
+    return {
+        "run": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": f"{platform.python_implementation()} {platform.python_version()}",
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def open_results(results_file, mode="r"):
+    """
+    Open a results file as text, gzip-compressed if its name ends in .gz.
+    """
+    if results_file.endswith(".gz"):
+        return gzip.open(results_file, mode + "t", newline="")
+    return open(results_file, mode, newline="")
 
-    # Run the benchmark and profiling
-    results = run_benchmarks_with_profiling()
+def result_records(results, datasets):
+    """
+    Flatten the per-engine, per-dataset results into one record per sample.
+    """
+    metadata = environment()
+    for engine_name, engine_results in results.items():
+        for dataset_path, dataset_results in zip(datasets, engine_results):
+            for operation, data in dataset_results.items():
+                for key, metric in METRICS.items():
+                    for repetition, value in enumerate(data[key]):
+                        yield {"engine": engine_name, "dataset": os.path.basename(dataset_path),
+                               "size": data["size"], "operation": operation, "repetition": repetition,
+                               "metric": metric, "value": value, **metadata}
+                # Counters are deterministic, so they are recorded once
+                for metric, value in data.get("counters", {}).items():
+                    yield {"engine": engine_name, "dataset": os.path.basename(dataset_path),
+                           "size": data["size"], "operation": operation, "repetition": 0,
+                           "metric": metric, "value": value, **metadata}
+
+def write_records(records, results_file):
+    """
+    Stream records to JSON Lines, or CSV if the file name ends in .csv (.csv.gz), with
+    optional gzip compression.
+    """
+    with open_results(results_file, "w") as f:
+        if results_file.endswith((".csv", ".csv.gz")):
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            for record in records:
+                f.write(json.dumps(record))
+                f.write("\n")
+
+def save_results(results, datasets, results_file=RESULTS_FILE):
+    """
+    Save the results of every engine as one record per sample, with the per-engine result
+    lists in the order of `datasets`.
+    """
+    write_records(result_records(results, datasets), results_file)
 
-    profiler.disable()
+def pin_to_cores(cores):
+    """
+    Pool initializer: restrict the worker to the given CPU cores where the OS allows it.
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
 
-    # Save profiling stats
-    s = io.StringIO()
-    ps = pstats.Stats(profiler, stream=s).sort_stats(pstats.SortKey.TIME)
-    ps.print_stats()
+def run_cell(engine_name, dataset_path, operation, repetition, warmup=1, counters=False):
+    """
+    Measure one (engine, dataset, operation, repetition) cell. Runs inside a pool worker,
+    so the dataset is loaded here and only plain numbers travel back to the parent.
+    With `counters`, the first repetition also records the work counters.
+    """
+    dataset = load_dataset(dataset_path)
+    engine = ENGINES[engine_name]
+    timings = time_operation(engine, operation, dataset, repeats=1, warmup=warmup)
+    net_bytes, peak_bytes, _ = measure_memory(engine, operation, dataset)
+    cell = {
+        "engine": engine_name,
+        "dataset": dataset_path,
+        "operation": operation,
+        "repetition": repetition,
+        "size": len(dataset),
+        "time": timings[0] / 1e9 / max(len(dataset), 1),
+        "memory": net_bytes / 2 ** 20,
+        "peak_memory": peak_bytes / 2 ** 20,
+    }
+    if counters and repetition == 0 and "counting_factory" in engine:
+        cell["counters"] = count_operation(engine, operation, dataset)
+    return cell
+
+def run_benchmarks_parallel(datasets=DATASETS, engines=tuple(ENGINES), repeats=5, warmup=1,
+                            workers=None, cores=None, results_file=RESULTS_FILE, counters=False):
+    """
+    Fan every (engine, dataset, operation, repetition) cell out to its own freshly spawned
+    interpreter, so no cell inherits memory or warmed caches from another, and merge the
+    cells into the same report as run_benchmarks. Workers are confined to `cores` (all
+    available cores by default) and there is one worker per core unless `workers` is given.
+    Trees never leave the workers, so there is no visualization in this mode.
+    """
+    if cores is None and hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    workers = workers or (len(cores) if cores else os.cpu_count())
+
+    cells = [(engine_name, dataset_path, operation, repetition)
+             for dataset_path in datasets
+             for engine_name in engines
+             for operation in OPERATIONS
+             for repetition in range(repeats)]
+    records = []
+    # maxtasksperchild=1 retires every worker after one cell, so the next cell starts in a
+    # clean interpreter
+    with multiprocessing.get_context("spawn").Pool(workers, initializer=pin_to_cores,
+                                                   initargs=(set(cores or ()),),
+                                                   maxtasksperchild=1) as pool:
+        pending = [pool.apply_async(run_cell, (*cell, warmup, counters)) for cell in cells]
+        for done, result in enumerate(pending, 1):
+            records.append(result.get())
+            print(f"Finished {done}/{len(cells)} benchmark cells")
+
+    # Merge the cells into the per-engine, per-dataset layout of run_benchmarks
+    results = {engine_name: [{operation: {"size": 0, "times": [], "memory": [], "peak_memory": []}
+                              for operation in OPERATIONS}
+                             for _ in datasets]
+               for engine_name in engines}
+    for record in sorted(records, key=lambda record: record["repetition"]):
+        data = results[record["engine"]][datasets.index(record["dataset"])][record["operation"]]
+        data["size"] = record["size"]
+        data["times"].append(record["time"])
+        data["memory"].append(record["memory"])
+        data["peak_memory"].append(record["peak_memory"])
+        if "counters" in record:
+            data["counters"] = record["counters"]
+
+    save_results(results, datasets, results_file)
+    return results
 
-    with open("../result/profiling_stats.txt", "w") as f:
-        f.write(s.getvalue())
+def run_workloads(traces, datasets=DATASETS, engines=tuple(ENGINES), interval=1.0,
+                  results_file=WORKLOAD_RESULTS_FILE):
+    """
+    Replay every trace against every engine, preloaded with each dataset, and save the
+    latency percentiles (in microseconds) and the throughput of every run.
+    """
+    results = []
+    for dataset_path in datasets:
+        dataset = load_dataset(dataset_path)
+        for engine_name in engines:
+            for trace_path in traces:
+                print(f"Replaying {trace_path} on {engine_name} preloaded with {dataset_path}")
+                engine = ENGINES[engine_name]
+                tree = prepare_tree(engine, "search", dataset)
+                gc.collect()
+                run = replay(tree, read_trace(trace_path), interval)
+                results.append((engine_name, dataset_path, trace_path, run))
+
+    with open(results_file, "w") as f:
+        for engine_name, dataset_path, trace_path, run in results:
+            f.write(f"{engine_name} - Dataset: {os.path.basename(dataset_path)} - "
+                    f"Trace: {os.path.basename(trace_path)}\n")
+            f.write(f"  Operations: {run['operations']}\n")
+            f.write(f"  Throughput: {run['throughput']:.1f} ops/s\n")
+            for operation, histogram in run["latency"].items():
+                summary = histogram.summary()
+                latencies = ", ".join(f"{name}={value / 1e3:.2f}" for name, value in summary.items()
+                                      if name != "count")
+                f.write(f"  {operation.capitalize()} Latency (us, n={summary['count']}): {latencies}\n")
+            timeline = ", ".join(f"{seconds:.2f}s={rate:.0f}" for seconds, rate in run["timeline"])
+            f.write(f"  Throughput Timeline (ops/s): {timeline}\n\n")
+    return results
 
-    print("Benchmarking and profiling complete. Results saved to benchmark_results.txt and profiling_stats.txt.")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AVL tree engines.")
+    parser.add_argument("--datasets", nargs="+", default=DATASETS, help="dataset files to load")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--repeats", type=int, default=5, help="measured runs per operation")
+    parser.add_argument("--warmup", type=int, default=1, help="discarded runs before measuring")
+    parser.add_argument("--no-visualize", dest="visualize", action="store_false",
+                        help="skip the tree snapshots after each operation")
+    parser.add_argument("--visual-dir", default=DEFAULT_OUTPUT_DIR,
+                        help="directory for the tree snapshots")
+    parser.add_argument("--visual-format", default="png",
+                        help="Graphviz output format of the snapshots, or 'dot' to only write DOT files")
+    parser.add_argument("--visual-max-depth", type=int, default=8,
+                        help="levels drawn per snapshot before subtrees are summarized")
+    parser.add_argument("--visual-max-nodes", type=int, default=255,
+                        help="nodes drawn per snapshot before subtrees are summarized")
+    parser.add_argument("--profile", action="store_true",
+                        help="also run under cProfile and save the stats")
+    parser.add_argument("--counters", action="store_true",
+                        help="also record the work counters (comparisons, nodes visited, rotations, "
+                             "retrace depth, allocations, tree height) of the AVL engines in an "
+                             "extra untimed run per operation")
+    parser.add_argument("--parallel", action="store_true",
+                        help="run every benchmark cell in its own worker process")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes for --parallel (default: one per core)")
+    parser.add_argument("--cores", type=int, nargs="+", default=None,
+                        help="CPU cores the --parallel workers are pinned to")
+    parser.add_argument("--workload", nargs="+", default=None, metavar="TRACE",
+                        help="replay these workload traces (see workload.py) instead of the "
+                             "insert/search/delete benchmark")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds per point of the --workload throughput timeline")
+    parser.add_argument("--workload-results", default=WORKLOAD_RESULTS_FILE,
+                        help="text report of the --workload replays")
+    parser.add_argument("--results", default=RESULTS_FILE,
+                        help="results file, JSON Lines or .csv, gzip-compressed if it ends in .gz")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Run the benchmark
+    if args.workload:
+        results = run_workloads(args.workload, args.datasets, args.engines, args.interval,
+                                args.workload_results)
+    elif args.parallel:
+        results = run_benchmarks_parallel(args.datasets, args.engines, args.repeats, args.warmup,
+                                          args.workers, args.cores, args.results, args.counters)
+    else:
+        visualizer = None
+        if args.visualize:
+            visualizer = Visualizer(args.visual_dir, args.visual_format,
+                                    max_depth=args.visual_max_depth, max_nodes=args.visual_max_nodes)
+        results = run_benchmarks(args.datasets, args.engines, args.repeats, args.warmup, visualizer,
+                                 args.results, args.counters)
+        if visualizer is not None:
+            visualizer.close()
+
+    if args.profile:
+        profiler.disable()
+
+        # Save profiling stats
+        s = io.StringIO()
+        ps = pstats.Stats(profiler, stream=s).sort_stats(pstats.SortKey.TIME)
+        ps.print_stats()
+
+        with open(PROFILE_FILE, "w") as f:
+            f.write(s.getvalue())
+
+    results_file = args.workload_results if args.workload else args.results
+    print(f"Benchmarking complete. Results saved to {results_file}.")
@@ -0,0 +1,338 @@
+import array
+import heapq
+from bisect import bisect_left, bisect_right
+
+
+class BPlusTree:
+    # Keys live only in the leaves; internal nodes hold separators, where every key in
+    # children[node][i] lies between keys[node][i - 1] and keys[node][i] (inclusive, so
+    # duplicate keys may straddle a separator). Each node's keys are one contiguous
+    # array searched with bisect, and leaves are doubly linked for range scans.
+    def __init__(self, order=64, key_typecode='i'):
+        if order < 3:
+            raise ValueError("Order must be at least 3")
+        self.order = order  # Maximum number of keys per node
+        self.min_keys = order // 2
+        self.key_typecode = key_typecode
+        self.keys = []  # Node id -> array of keys (separators for internal nodes)
+        self.children = []  # Node id -> array('i') of child ids, None for leaves
+        self.next = array.array('i')  # Leaf id -> next leaf id or -1
+        self.prev = array.array('i')  # Leaf id -> previous leaf id or -1
+        self.free = []
+        self.count = 0
+        self.root = self._allocate(None)
+
+    @classmethod
+    def from_sorted(cls, keys, **options):
+        tree = cls(**options)
+        keys = array.array(tree.key_typecode, keys)
+        for i in range(1, len(keys)):
+            if keys[i - 1] > keys[i]:
+                raise ValueError("Keys must be sorted")
+        tree._load_sorted(keys)
+        return tree
+
+    @classmethod
+    def from_iterable(cls, keys, **options):
+        return cls.from_sorted(sorted(keys), **options)
+
+    def _load_sorted(self, keys):
+        # Replace the whole tree, filling the leaves and then every level above as evenly
+        # as possible, so each node ends up with between min_keys and order keys
+        self.keys = []
+        self.children = []
+        self.next = array.array('i')
+        self.prev = array.array('i')
+        self.free = []
+        self.count = len(keys)
+
+        # (node, smallest key in its subtree) for every node of the level being built
+        level = []
+        for lo, hi in self._even_chunks(len(keys), self.order):
+            leaf = self._allocate(None)
+            self.keys[leaf] = keys[lo:hi]
+            if level:
+                self.next[level[-1][0]] = leaf
+                self.prev[leaf] = level[-1][0]
+            level.append((leaf, keys[lo]))
+        if not level:
+            self.root = self._allocate(None)
+            return
+
+        while len(level) > 1:
+            parents = []
+            for lo, hi in self._even_chunks(len(level), self.order + 1):
+                node = self._allocate(array.array('i', [child for child, _ in level[lo:hi]]))
+                self.keys[node] = array.array(self.key_typecode, [low for _, low in level[lo + 1:hi]])
+                parents.append((node, level[lo][1]))
+            level = parents
+        self.root = level[0][0]
+
+    @staticmethod
+    def _even_chunks(n, capacity):
+        chunks = -(-n // capacity)
+        return [(i * n // chunks, (i + 1) * n // chunks) for i in range(chunks)]
+
+    def _allocate(self, children):
+        if self.free:
+            node = self.free.pop()
+            self.keys[node] = array.array(self.key_typecode)
+            self.children[node] = children
+            self.next[node] = -1
+            self.prev[node] = -1
+        else:
+            node = len(self.keys)
+            self.keys.append(array.array(self.key_typecode))
+            self.children.append(children)
+            self.next.append(-1)
+            self.prev.append(-1)
+        return node
+
+    def _release(self, node):
+        self.keys[node] = None
+        self.children[node] = None
+        self.free.append(node)
+
+    def __len__(self):
+        return self.count
+
+    def height(self):
+        height = 1
+        node = self.root
+        while self.children[node] is not None:
+            node = self.children[node][0]
+            height += 1
+        return height
+
+    def insert(self, key):
+        keys = self.keys
+        children = self.children
+
+        # Descend to the leaf, remembering (node, child index) for splits
+        path = []
+        node = self.root
+        while children[node] is not None:
+            index = bisect_right(keys[node], key)
+            path.append((node, index))
+            node = children[node][index]
+
+        leaf_keys = keys[node]
+        leaf_keys.insert(bisect_right(leaf_keys, key), key)
+        self.count += 1
+        if len(leaf_keys) > self.order:
+            self._split(path, node)
+
+    def _split(self, path, node):
+        keys = self.keys
+        children = self.children
+        while len(keys[node]) > self.order:
+            node_keys = keys[node]
+            mid = len(node_keys) // 2
+            separator = node_keys[mid]
+            if children[node] is None:
+                # Leaf: the upper half moves to a new leaf, its first key is copied up
+                sibling = self._allocate(None)
+                keys[sibling] = node_keys[mid:]
+                following = self.next[node]
+                self.next[sibling] = following
+                self.prev[sibling] = node
+                if following != -1:
+                    self.prev[following] = sibling
+                self.next[node] = sibling
+                del node_keys[mid:]
+            else:
+                # Internal node: the middle separator moves up
+                node_children = children[node]
+                sibling = self._allocate(node_children[mid + 1:])
+                keys[sibling] = node_keys[mid + 1:]
+                del node_keys[mid:]
+                del node_children[mid + 1:]
+
+            if not path:
+                self.root = self._allocate(array.array('i', [node, sibling]))
+                keys[self.root].append(separator)
+                return
+            parent, index = path.pop()
+            keys[parent].insert(index, separator)
+            children[parent].insert(index + 1, sibling)
+            node = parent
+
+    def search(self, key):
+        keys = self.keys
+        children = self.children
+        node = self.root
+        child_ids = children[node]
+        while child_ids is not None:
+            node = child_ids[bisect_left(keys[node], key)]
+            child_ids = children[node]
+
+        leaf_keys = keys[node]
+        index = bisect_left(leaf_keys, key)
+        if index < len(leaf_keys):
+            return node if leaf_keys[index] == key else -1
+        # Past the end of the leaf the leftmost copy can only start the next leaf
+        node = self.next[node]
+        if node != -1 and keys[node][0] == key:
+            return node
+        return -1
+
+    def delete(self, key):
+        self._delete(key)
+
+    def _delete(self, key):
+        keys = self.keys
+        children = self.children
+
+        path = []
+        node = self.root
+        while children[node] is not None:
+            index = bisect_left(keys[node], key)
+            path.append((node, index))
+            node = children[node][index]
+
+        leaf_keys = keys[node]
+        index = bisect_left(leaf_keys, key)
+        if index == len(leaf_keys):
+            node = self._next_leaf(path)
+            if node == -1:
+                return False
+            leaf_keys = keys[node]
+            index = 0
+        if leaf_keys[index] != key:
+            return False
+
+        del leaf_keys[index]
+        self.count -= 1
+        self._fix_underflow(path, node)
+        return True
+
+    def _next_leaf(self, path):
+        # Advance path to the leaf after the one it leads to, or return -1 at the last leaf
+        children = self.children
+        while path:
+            node, index = path.pop()
+            if index + 1 < len(children[node]):
+                path.append((node, index + 1))
+                child = children[node][index + 1]
+                while children[child] is not None:
+                    path.append((child, 0))
+                    child = children[child][0]
+                return child
+        return -1
+
+    def _fix_underflow(self, path, node):
+        keys = self.keys
+        children = self.children
+        min_keys = self.min_keys
+        while path and len(keys[node]) < min_keys:
+            parent, index = path.pop()
+            parent_keys = keys[parent]
+            siblings = children[parent]
+            left = siblings[index - 1] if index > 0 else -1
+            right = siblings[index + 1] if index + 1 < len(siblings) else -1
+            node_keys = keys[node]
+
+            # Borrow from a sibling that can spare a key
+            if left != -1 and len(keys[left]) > min_keys:
+                if children[node] is None:
+                    node_keys.insert(0, keys[left].pop())
+                    parent_keys[index - 1] = node_keys[0]
+                else:
+                    node_keys.insert(0, parent_keys[index - 1])
+                    parent_keys[index - 1] = keys[left].pop()
+                    children[node].insert(0, children[left].pop())
+                return
+            if right != -1 and len(keys[right]) > min_keys:
+                if children[node] is None:
+                    node_keys.append(keys[right].pop(0))
+                    parent_keys[index] = keys[right][0]
+                else:
+                    node_keys.append(parent_keys[index])
+                    parent_keys[index] = keys[right].pop(0)
+                    children[node].append(children[right].pop(0))
+                return
+
+            # Otherwise merge the right node of a sibling pair into the left one
+            if left != -1:
+                index -= 1
+                node, right = left, node
+            if children[node] is None:
+                keys[node].extend(keys[right])
+                following = self.next[right]
+                self.next[node] = following
+                if following != -1:
+                    self.prev[following] = node
+            else:
+                keys[node].append(parent_keys[index])
+                keys[node].extend(keys[right])
+                children[node].extend(children[right])
+            del parent_keys[index]
+            del siblings[index + 1]
+            self._release(right)
+            node = parent
+
+        # An internal root left with a single child hands the root role to that child
+        root = self.root
+        if children[root] is not None and not keys[root]:
+            self.root = children[root][0]
+            self._release(root)
+
+    def insert_many(self, keys):
+        batch = sorted(keys)
+        # Like the AVL engines, rebuild when the batch is comparable to the tree size
+        if len(batch) * 4 >= self.count:
+            self._load_sorted(array.array(self.key_typecode, heapq.merge(self, batch)))
+            return
+        for key in batch:
+            self.insert(key)
+
+    def search_many(self, keys):
+        return array.array('i', map(self.search, keys))
+
+    def delete_many(self, keys):
+        return [self._delete(key) for key in keys]
+
+    def __iter__(self):
+        return self.range()
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # Lazily yield the keys in [lo, hi) in order by walking the leaf chain
+        keys = self.keys
+        children = self.children
+        if not reverse:
+            node = self._leaf_for(lo)
+            index = 0 if lo is None else bisect_left(keys[node], lo)
+            while node != -1:
+                leaf_keys = keys[node]
+                for i in range(index, len(leaf_keys)):
+                    key = leaf_keys[i]
+                    if hi is not None and key >= hi:
+                        return
+                    yield key
+                node = self.next[node]
+                index = 0
+        else:
+            node = self._leaf_for(hi, last=True)
+            index = len(keys[node]) if hi is None else bisect_left(keys[node], hi)
+            while node != -1:
+                leaf_keys = keys[node]
+                for i in range(index - 1, -1, -1):
+                    key = leaf_keys[i]
+                    if lo is not None and key < lo:
+                        return
+                    yield key
+                node = self.prev[node]
+                if node != -1:
+                    index = len(keys[node])
+
+    def _leaf_for(self, key, last=False):
+        # Leftmost leaf that may hold key, or the first (last) leaf when key is None
+        keys = self.keys
+        children = self.children
+        node = self.root
+        while children[node] is not None:
+            if key is None:
+                node = children[node][-1 if last else 0]
+            else:
+                node = children[node][bisect_left(keys[node], key)]
+        return node
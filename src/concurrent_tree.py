@@ -0,0 +1,322 @@
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from reference_avl_tree import AVLTreeReference
+from array_avl_tree import ArrayAVLTree
+
+
+class ReadWriteLock:
+    """
+    Many concurrent readers or a single writer. Waiting writers block new readers,
+    so a steady stream of searches cannot starve inserts and deletes.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def tree_insert(tree, key):
+    """
+    Insert a key into any engine, threading the root for the reference-based tree.
+    """
+    if isinstance(tree, AVLTreeReference):
+        tree.root = tree.insert(tree.root, key)
+    else:
+        tree.insert(key)
+
+
+def tree_delete(tree, key):
+    """
+    Delete one occurrence of a key from any engine and report whether it was present.
+    """
+    if isinstance(tree, AVLTreeReference):
+        path, node = tree.find_path(tree.root, key)
+        if not node:
+            return False
+        tree.root = tree.unlink(path, node)
+        return True
+    count = len(tree)
+    tree.delete(key)
+    return len(tree) < count
+
+
+def tree_search(tree, key):
+    """
+    Search any engine, returning whatever the engine returns (a node or a node index).
+    """
+    if isinstance(tree, AVLTreeReference):
+        return tree.search(tree.root, key)
+    return tree.search(key)
+
+
+def tree_contains(tree, key):
+    result = tree_search(tree, key)
+    return result is not None and result != -1
+
+
+class ConcurrentTree:
+    """
+    Thread-safe front-end over a single tree engine. Searches and scans share a read
+    lock, updates take the write lock. Range scans are materialized under the lock
+    because a lazy iterator cannot hold it across the caller's loop.
+
+    A tree with a search cache or finger search updates them on every search, so its
+    searches take the write lock too.
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        self.lock = ReadWriteLock()
+        if getattr(tree, "cache", None) is not None or getattr(tree, "finger_search", False):
+            self.search_locked = self.lock.write_locked
+        else:
+            self.search_locked = self.lock.read_locked
+
+    def __len__(self):
+        with self.lock.read_locked():
+            tree = self.tree
+            if isinstance(tree, AVLTreeReference):
+                if not tree.multiset:
+                    return tree.node_count - tree.tombstones
+                if tree.order_stats:
+                    return tree.get_size(tree.root)
+                # Multiset occurrences are only summed up by the subtree sizes
+                return sum(1 for _ in tree)
+            return len(tree)
+
+    def insert(self, key):
+        with self.lock.write_locked():
+            tree_insert(self.tree, key)
+
+    def delete(self, key):
+        with self.lock.write_locked():
+            return tree_delete(self.tree, key)
+
+    def search(self, key):
+        with self.search_locked():
+            return tree_search(self.tree, key)
+
+    def contains(self, key):
+        with self.search_locked():
+            return tree_contains(self.tree, key)
+
+    def insert_many(self, keys):
+        with self.lock.write_locked():
+            self.tree.insert_many(keys)
+
+    def delete_many(self, keys):
+        with self.lock.write_locked():
+            return self.tree.delete_many(keys)
+
+    def search_many(self, keys):
+        with self.search_locked():
+            return self.tree.search_many(keys)
+
+    def contains_many(self, keys):
+        with self.search_locked():
+            results = self.tree.search_many(keys)
+        return [result is not None and result != -1 for result in results]
+
+    def range(self, lo=None, hi=None, reverse=False):
+        with self.lock.read_locked():
+            return list(self.tree.range(lo, hi, reverse))
+
+
+# Tree owned by a shard worker process, created by the pool initializer
+_shard_tree = None
+
+
+def _init_shard(engine, engine_options):
+    global _shard_tree
+    _shard_tree = ConcurrentTree(engine(**engine_options))
+
+
+def _shard_call(name, args):
+    return getattr(_shard_tree, name)(*args)
+
+
+class _ThreadShard:
+    def __init__(self, engine, engine_options, pool):
+        self.tree = ConcurrentTree(engine(**engine_options))
+        self.pool = pool
+
+    def call(self, name, *args):
+        return getattr(self.tree, name)(*args)
+
+    def submit(self, name, *args):
+        return self.pool.submit(getattr(self.tree, name), *args)
+
+    def close(self):
+        pass
+
+
+class _ProcessShard:
+    # One single-worker pool per shard, so the shard's tree lives in that worker for good
+    def __init__(self, engine, engine_options):
+        self.pool = ProcessPoolExecutor(max_workers=1, initializer=_init_shard,
+                                        initargs=(engine, engine_options))
+
+    def call(self, name, *args):
+        return self.submit(name, *args).result()
+
+    def submit(self, name, *args):
+        return self.pool.submit(_shard_call, name, args)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class ShardedTree:
+    """
+    Partition the key space over num_shards independent trees, each behind its own lock.
+
+    partition="hash" spreads keys by hash(key) % num_shards. partition="range" sends keys
+    below boundaries[0] to shard 0, keys in [boundaries[i - 1], boundaries[i]) to shard i
+    and so on, which keeps range scans on the shards they overlap.
+
+    executor="thread" keeps the shards in this process and runs batch sub-requests on a
+    thread pool. executor="process" gives every shard its own worker process, so updates
+    on different shards run on different cores. Lookups return True/False rather than
+    engine nodes, since nodes cannot leave a worker process.
+    """
+    def __init__(self, num_shards=4, engine=ArrayAVLTree, engine_options=None,
+                 partition="hash", boundaries=None, executor="thread"):
+        engine_options = engine_options or {}
+        if partition == "range":
+            if boundaries is None or len(boundaries) != num_shards - 1:
+                raise ValueError("Range partitioning needs num_shards - 1 sorted boundaries")
+            boundaries = sorted(boundaries)
+        elif partition != "hash":
+            raise ValueError(f"Unknown partition: {partition}")
+
+        self.partition = partition
+        self.boundaries = boundaries
+        self.pool = None
+        if executor == "thread":
+            self.pool = ThreadPoolExecutor(max_workers=num_shards)
+            self.shards = [_ThreadShard(engine, engine_options, self.pool) for _ in range(num_shards)]
+        elif executor == "process":
+            self.shards = [_ProcessShard(engine, engine_options) for _ in range(num_shards)]
+        else:
+            raise ValueError(f"Unknown executor: {executor}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def shard_of(self, key):
+        if self.partition == "range":
+            return bisect_right(self.boundaries, key)
+        return hash(key) % len(self.shards)
+
+    def __len__(self):
+        futures = [shard.submit("__len__") for shard in self.shards]
+        return sum(future.result() for future in futures)
+
+    def insert(self, key):
+        self.shards[self.shard_of(key)].call("insert", key)
+
+    def delete(self, key):
+        return self.shards[self.shard_of(key)].call("delete", key)
+
+    def contains(self, key):
+        return self.shards[self.shard_of(key)].call("contains", key)
+
+    def insert_many(self, keys):
+        self._scatter("insert_many", keys)
+
+    def delete_many(self, keys):
+        return self._scatter("delete_many", keys)
+
+    def contains_many(self, keys):
+        return self._scatter("contains_many", keys)
+
+    def range(self, lo=None, hi=None, reverse=False):
+        """
+        Keys in [lo, hi) from every shard that can hold them, merged into one sorted list.
+        """
+        if self.partition == "range":
+            first = 0 if lo is None else bisect_right(self.boundaries, lo)
+            last = len(self.shards) - 1 if hi is None else bisect_left(self.boundaries, hi)
+            shard_ids = range(first, last + 1)
+            if reverse:
+                shard_ids = reversed(shard_ids)
+            futures = [self.shards[i].submit("range", lo, hi, reverse) for i in shard_ids]
+            return [key for future in futures for key in future.result()]
+        futures = [shard.submit("range", lo, hi, reverse) for shard in self.shards]
+        return list(heapq.merge(*(future.result() for future in futures), reverse=reverse))
+
+    def _scatter(self, name, keys):
+        """
+        Split a batch by shard, run the sub-batches in parallel and return the per-key
+        results (if any) aligned with the input.
+        """
+        keys = list(keys)
+        positions = [[] for _ in self.shards]
+        for i, key in enumerate(keys):
+            positions[self.shard_of(key)].append(i)
+
+        futures = []
+        for shard, shard_positions in zip(self.shards, positions):
+            if shard_positions:
+                futures.append((shard_positions, shard.submit(name, [keys[i] for i in shard_positions])))
+
+        results = [None] * len(keys)
+        for shard_positions, future in futures:
+            shard_results = future.result()
+            if shard_results is not None:
+                for i, result in zip(shard_positions, shard_results):
+                    results[i] = result
+        return results
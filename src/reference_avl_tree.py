@@ -1,113 +1,960 @@
+import heapq
+import sys
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
 class AVLTreeNode:
-    def __init__(self, key):
+    # Fixed slots instead of a per-instance __dict__ keep every node a few dozen bytes. A plain
+    # tree needs only these four fields; the optional modes use AugmentedAVLTreeNode.
+    __slots__ = ("key", "left", "right", "height")
+
+    # Read-only stand-ins for the fields of AugmentedAVLTreeNode, never updated in a plain tree
+    size = 1
+    count = 1
+    generation = 0
+
+    def __init__(self, key, generation=0):
         self.key = key
         self.left = None
         self.right = None
         self.height = 1
 
 
+class AugmentedAVLTreeNode(AVLTreeNode):
+    # Node of a tree with order statistics, multiset, lazy delete or persistent mode enabled
+    __slots__ = ("size", "count", "generation")
+
+    def __init__(self, key, generation=0):
+        super().__init__(key)
+        self.size = 1
+        # Occurrences of key, only ever above 1 in multiset mode. 0 marks a tombstone left
+        # by a lazy delete.
+        self.count = 1
+        # Tree generation the node was created in, see AVLTreeReference.snapshot
+        self.generation = generation
+
+
 class AVLTreeReference:
-    def __init__(self):
+    def __init__(self, order_stats=False, persistent=False, multiset=False, tombstone_threshold=None,
+                 search_cache=None, finger_search=False):
         self.root = None
+        # Number of nodes in the tree, tombstones included
+        self.node_count = 0
+        # Optional subtree sizes for rank/select, kept up to date by rotations and retracing
+        self.order_stats = order_stats
+        # Multiset mode stores every distinct key once, with its number of occurrences
+        self.multiset = multiset
+        # In persistent mode nodes from an older generation may be shared with a snapshot
+        # and are copied on write instead of modified in place
+        self.persistent = persistent
+        self.generation = 0
+        # When set, deletes only turn nodes into tombstones, and the tree is rebuilt from its
+        # live keys once the tombstones exceed this fraction of the nodes
+        self.tombstone_threshold = tombstone_threshold
+        self.tombstones = 0
+        # Optional LRU cache of searches from the tree root, at most search_cache keys mapped to
+        # their node (or None). Rotations relink nodes without moving keys, so only the keys
+        # whose node appears, is unlinked, moves or is copied on write are evicted; bulk
+        # operations clear it.
+        self.search_cache = search_cache
+        self.cache = OrderedDict() if search_cache else None
+        # Finger search resumes from the path of the previous search, kept as
+        # (node, lower bound, upper bound) entries. Any change to the shape drops it.
+        self.finger_search = finger_search
+        self.finger = None
+        # Plain trees use the smaller node without subtree size, count and generation
+        augmented = order_stats or persistent or multiset or tombstone_threshold is not None
+        self.node_type = AugmentedAVLTreeNode if augmented else AVLTreeNode
 
-    def insert(self, root, key):
-        # Standard BST insert
-        if not root:
-            return AVLTreeNode(key)
-
-        if key < root.key:
-            root.left = self.insert(root.left, key)
-        else:
-            root.right = self.insert(root.right, key)
+    @classmethod
+    def from_sorted(cls, keys, **options):
+        # Build a height-balanced tree from already sorted keys in one linear pass
+        keys = list(keys)
+        for i in range(1, len(keys)):
+            if keys[i - 1] > keys[i]:
+                raise ValueError("Keys must be sorted")
+        tree = cls(**options)
+        tree.root = tree.build_sorted(keys)
+        return tree
 
-        # Update height of the ancestor node
-        root.height = 1 + max(self.get_height(root.left), self.get_height(root.right))
+    @classmethod
+    def from_iterable(cls, keys, **options):
+        return cls.from_sorted(sorted(keys), **options)
 
-        # Get balance factor to check if the node is unbalanced
-        balance = self.get_balance(root)
+    def build_sorted(self, keys):
+        # Balanced tree over sorted keys. In multiset mode every run of equal keys becomes one node.
+        keys = list(keys)
+        self.node_count = 0
+        self.tombstones = 0
+        self.forget_all()
+        if not self.multiset:
+            return self.build_balanced(keys, 0, len(keys))
+        unique = []
+        counts = []
+        for key in keys:
+            if unique and unique[-1] == key:
+                counts[-1] += 1
+            else:
+                unique.append(key)
+                counts.append(1)
+        return self.build_balanced(unique, 0, len(unique), counts)
 
-        # Perform rotations to balance the tree
-        # Left Left Case
-        if balance > 1 and key < root.left.key:
-            return self.right_rotate(root)
+    def build_balanced(self, keys, lo, hi, counts=None):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        node = self.node_type(keys[mid], self.generation)
+        self.node_count += 1
+        node.left = self.build_balanced(keys, lo, mid, counts)
+        node.right = self.build_balanced(keys, mid + 1, hi, counts)
+        # A subtree built from m keys by midpoint splitting has height bit_length(m)
+        node.height = (hi - lo).bit_length()
+        if counts is None:
+            if self.order_stats:
+                node.size = hi - lo
+        else:
+            node.count = counts[mid]
+            self.update_size(node)
+        return node
 
-        # Right Right Case
-        if balance < -1 and key > root.right.key:
-            return self.left_rotate(root)
+    def insert(self, root, key):
+        # Standard BST insert, remembering the path for retracing
+        path = []
+        node = root
+        while node:
+            path.append(node)
+            if key == node.key and (self.multiset or not node.count):
+                # Multiset insert of a present key, or any insert landing on a tombstone of the
+                # key, only bumps its count, the shape never changes
+                if not node.count:
+                    self.tombstones -= 1
+                    self.forget(key)
+                if self.persistent:
+                    path = self.copy_path(path)
+                path[-1].count += 1
+                if self.order_stats:
+                    for ancestor in path:
+                        ancestor.size += 1
+                return path[0]
+            if key < node.key:
+                node = node.left
+            else:
+                node = node.right
 
-        # Left Right Case
-        if balance > 1 and key > root.left.key:
-            root.left = self.left_rotate(root.left)
-            return self.right_rotate(root)
+        if self.persistent:
+            path = self.copy_path(path)
 
-        # Right Left Case
-        if balance < -1 and key < root.right.key:
-            root.right = self.right_rotate(root.right)
-            return self.left_rotate(root)
+        new_node = self.node_type(key, self.generation)
+        self.node_count += 1
+        self.forget(key)
+        if path:
+            parent = path[-1]
+            if key < parent.key:
+                parent.left = new_node
+            else:
+                parent.right = new_node
 
-        return root
+        return self.retrace(path, new_node, new_node, 1)
 
     def delete(self, root, key):
-        if not root:
+        # Remove one occurrence of key
+        path, node = self.find_path(root, key)
+        if not node:
             return root
+        return self.unlink(path, node)
 
-        # Standard BST delete
-        if key < root.key:
-            root.left = self.delete(root.left, key)
-        elif key > root.key:
-            root.right = self.delete(root.right, key)
-        else:
-            # Node with one child or no child
-            if not root.left:
-                temp = root.right
-                root = None
-                return temp
-            elif not root.right:
-                temp = root.left
-                root = None
-                return temp
-
-            # Node with two children: Get the inorder successor
-            temp = self.get_min_value_node(root.right)
-            root.key = temp.key
-            root.right = self.delete(root.right, temp.key)
+    def delete_all(self, root, key):
+        # Remove every occurrence of key
+        path, node = self.find_path(root, key)
+        while node:
+            root = self.unlink(path, node, remove_all=True)
+            path, node = self.find_path(root, key)
+        return root
 
-        # Update height of the current node
-        root.height = 1 + max(self.get_height(root.left), self.get_height(root.right))
+    def count(self, key):
+        # Number of stored occurrences of key
+        if self.multiset:
+            node = self.search(self.root, key)
+            return node.count if node else 0
+        occurrences = 0
+        for stored in self.range(key):
+            if stored != key:
+                break
+            occurrences += 1
+        return occurrences
+
+    def find_path(self, root, key):
+        # Standard BST search, remembering the path for retracing
+        if self.tombstone_threshold is not None:
+            return self.find_live_path(root, key)
+        path = []
+        node = root
+        while node and node.key != key:
+            path.append(node)
+            if key < node.key:
+                node = node.left
+            else:
+                node = node.right
+        return path, node
+
+    def find_live_path(self, root, key):
+        # find_path for a node holding a live occurrence of key. Equal keys form one inorder
+        # run, so past a tombstone both subtrees may hold the key.
+        path = []
+        node = root
+        while node and node.key != key:
+            path.append(node)
+            if key < node.key:
+                node = node.left
+            else:
+                node = node.right
+        if not node or node.count:
+            return path, node
+
+        pending = [(node, len(path))]
+        while pending:
+            node, depth = pending.pop()
+            del path[depth:]
+            while node:
+                if node.key == key:
+                    if node.count:
+                        return path, node
+                    path.append(node)
+                    pending.append((node.left, len(path)))
+                    node = node.right
+                    continue
+                path.append(node)
+                if key < node.key:
+                    node = node.left
+                else:
+                    node = node.right
+        return [], None
 
-        # Get balance factor to check if the node is unbalanced
-        balance = self.get_balance(root)
+    def unlink(self, path, node, remove_all=False):
+        if self.tombstone_threshold is not None:
+            return self.bury(path, node, remove_all)
+        if self.multiset and node.count > 1 and not remove_all:
+            # Multiset delete of one of several occurrences only drops the count
+            path = path + [node]
+            if self.persistent:
+                path = self.copy_path(path)
+            path[-1].count -= 1
+            if self.order_stats:
+                for ancestor in path:
+                    ancestor.size -= 1
+            return path[0]
+        removed = node.count
+        self.node_count -= 1
+        self.forget(node.key)
 
-        # Perform rotations to balance the tree
-        # Left Left Case
-        if balance > 1 and self.get_balance(root.left) >= 0:
-            return self.right_rotate(root)
+        # Node with two children: copy the inorder successor up and unlink that node instead
+        target = node
+        if node.left and node.right:
+            node_position = len(path)
+            path.append(node)
+            target = node.right
+            while target.left:
+                path.append(target)
+                target = target.left
 
-        # Right Right Case
-        if balance < -1 and self.get_balance(root.right) <= 0:
-            return self.left_rotate(root)
+        if self.persistent:
+            path = self.copy_path(path)
 
-        # Left Right Case
-        if balance > 1 and self.get_balance(root.left) < 0:
-            root.left = self.left_rotate(root.left)
-            return self.right_rotate(root)
+        if target is not node:
+            self.forget(target.key)
+            path[node_position].key = target.key
+            if self.multiset:
+                path[node_position].count = target.count
+            # Retracing shifts the sizes it does not recompute by -removed, but the
+            # subtrees between the two nodes only lose the successor's occurrences
+            if self.order_stats and target.count != removed:
+                for ancestor in path[node_position + 1:]:
+                    ancestor.size += removed - target.count
 
-        # Right Left Case
-        if balance < -1 and self.get_balance(root.right) > 0:
-            root.right = self.right_rotate(root.right)
-            return self.left_rotate(root)
+        # Node with one child or no child
+        child = target.left if target.left else target.right
 
+        return self.retrace(path, target, child, -removed)
+
+    def bury(self, path, node, remove_all=False):
+        # Lazy delete: drop occurrences in place and leave a node without any linked as a
+        # tombstone. The shape never changes, so there is no successor copy or retracing.
+        path = path + [node]
+        if self.persistent:
+            path = self.copy_path(path)
+        removed = node.count if remove_all or not self.multiset else 1
+        path[-1].count -= removed
+        if self.order_stats:
+            for ancestor in path:
+                ancestor.size -= removed
+        root = path[0]
+        if not path[-1].count:
+            self.tombstones += 1
+            self.forget(node.key)
+            if self.tombstones > self.tombstone_threshold * self.node_count:
+                root = self.purge(root)
         return root
 
+    def purge(self, root):
+        # Rebuild from the live keys in order, dropping every tombstone
+        return self.build_sorted(self.walk(root))
+
+    def snapshot(self):
+        # O(1) point-in-time view. Bumping the generation makes every existing node shared,
+        # so later writes copy the nodes they touch and the view never changes.
+        if not self.persistent:
+            raise ValueError("Snapshots need a persistent tree, create it with persistent=True")
+        self.generation += 1
+        view = AVLTreeSnapshot(self.root, self.order_stats, self.multiset, self.tombstone_threshold)
+        view.node_count = self.node_count
+        view.tombstones = self.tombstones
+        return view
+
+    def copy_path(self, path):
+        # Replace every shared node on a root-to-node path by a private copy
+        copied = []
+        for node in path:
+            copy = self.writable(node)
+            if copied and copy is not node:
+                parent = copied[-1]
+                if parent.left is node:
+                    parent.left = copy
+                else:
+                    parent.right = copy
+            copied.append(copy)
+        return copied
+
+    def writable(self, node):
+        if node.generation == self.generation:
+            return node
+        # The copy replaces the node in the live tree
+        self.forget(node.key)
+        self.finger = None
+        copy = self.node_type(node.key, self.generation)
+        copy.left = node.left
+        copy.right = node.right
+        copy.height = node.height
+        copy.size = node.size
+        copy.count = node.count
+        return copy
+
+    def retrace(self, path, old_child, child, delta):
+        # Walk back up the path, relinking the replaced subtree and rebalancing.
+        # Once a subtree comes out with the same height it had before, nothing above it changes
+        # except the subtree sizes, which shift by delta all the way to the root.
+        self.finger = None
+        for i in range(len(path) - 1, -1, -1):
+            parent = path[i]
+            if parent.left is old_child:
+                parent.left = child
+            else:
+                parent.right = child
+
+            old_height = parent.height
+            old_child = parent
+            child = self.rebalance(parent)
+
+            if child.height == old_height:
+                if i == 0:
+                    return child
+                grandparent = path[i - 1]
+                if grandparent.left is old_child:
+                    grandparent.left = child
+                else:
+                    grandparent.right = child
+                if self.order_stats:
+                    for j in range(i):
+                        path[j].size += delta
+                return path[0]
+
+        return child
+
+    def rebalance(self, node):
+        left_height = node.left.height if node.left else 0
+        right_height = node.right.height if node.right else 0
+        balance = left_height - right_height
+
+        if balance > 1:
+            # Left Left Case
+            if self.get_balance(node.left) >= 0:
+                return self.right_rotate(node)
+
+            # Left Right Case
+            node.left = self.left_rotate(node.left)
+            return self.right_rotate(node)
+
+        if balance < -1:
+            # Right Right Case
+            if self.get_balance(node.right) <= 0:
+                return self.left_rotate(node)
+
+            # Right Left Case
+            node.right = self.right_rotate(node.right)
+            return self.left_rotate(node)
+
+        # Update height of the current node
+        node.height = 1 + (left_height if left_height > right_height else right_height)
+        if self.order_stats:
+            self.update_size(node)
+        return node
+
     def search(self, root, key):
+        cache = self.cache
+        if cache is None or root is not self.root:
+            return self.lookup(root, key)
+        node = cache.get(key, cache)
+        if node is not cache:
+            cache.move_to_end(key)
+            return node
+        node = cache[key] = self.lookup(root, key)
+        if len(cache) > self.search_cache:
+            cache.popitem(last=False)
+        return node
+
+    def lookup(self, root, key):
+        if self.finger_search:
+            node = self.finger_lookup(root, key)
+            if not node or self.tombstone_threshold is None or node.count:
+                return node
+        if self.tombstone_threshold is not None:
+            return self.find_live_path(root, key)[1]
         # Standard BST search
-        if not root:
+        node = root
+        while node:
+            if node.key == key:
+                return node
+            if key < node.key:
+                node = node.left
+            else:
+                node = node.right
+        return None
+
+    def finger_lookup(self, root, key):
+        # Climb the previous search path to the deepest node whose subtree must hold key if it
+        # is stored at all (key strictly between the subtree bounds), then descend from there.
+        # A key d positions away from the previous one typically costs O(log d); like any
+        # finger without level links, keys on either side of a high node still climb far.
+        finger = self.finger
+        if not finger or finger[0][0] is not root:
+            finger = self.finger = [(root, None, None)]
+        while len(finger) > 1:
+            _, lo, hi = finger[-1]
+            if (lo is None or lo < key) and (hi is None or key < hi):
+                break
+            finger.pop()
+        node, lo, hi = finger[-1]
+        while node:
+            if node.key == key:
+                return node
+            if key < node.key:
+                hi = node.key
+                node = node.left
+            else:
+                lo = node.key
+                node = node.right
+            if node:
+                finger.append((node, lo, hi))
+        return None
+
+    def forget(self, key):
+        # Evict one key from the search cache
+        if self.cache is not None:
+            self.cache.pop(key, None)
+
+    def forget_all(self):
+        # Drop the search cache and the finger after a bulk change of the tree
+        if self.cache is not None:
+            self.cache.clear()
+        self.finger = None
+
+    def insert_many(self, keys):
+        batch = sorted(keys)
+        # A batch comparable to the tree size is cheaper to merge with the inorder keys
+        # and rebuild in one linear pass than to insert key by key
+        if len(batch) * 4 >= self.node_count:
+            self.root = self.build_sorted(heapq.merge(self, batch))
+            return
+        # Otherwise insert in sorted order so consecutive keys walk mostly the same path
+        root = self.root
+        for key in batch:
+            root = self.insert(root, key)
+        self.root = root
+
+    def search_many(self, keys):
+        # One merged descent for the whole sorted batch: at each node the batch range is
+        # split around the node key, so neighbouring keys share their path prefix
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        batch = [keys[i] for i in order]
+        results = [None] * len(keys)
+
+        stack = [(self.root, 0, len(batch))]
+        while stack:
+            node, lo, hi = stack.pop()
+            if not node or lo >= hi:
+                continue
+            mid_lo = bisect_left(batch, node.key, lo, hi)
+            mid_hi = bisect_right(batch, node.key, mid_lo, hi)
+            for j in range(mid_lo, mid_hi):
+                results[order[j]] = node
+            stack.append((node.left, lo, mid_lo))
+            stack.append((node.right, mid_hi, hi))
+        if self.tombstones:
+            # Redo the lookups that stopped at a tombstone, a live copy of the key may lie below
+            for i, node in enumerate(results):
+                if node and not node.count:
+                    results[i] = self.search(self.root, keys[i])
+        return results
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        deleted = [False] * len(keys)
+
+        if len(keys) * 4 >= self.node_count:
+            # Walk the inorder keys and the sorted batch together, dropping one stored
+            # occurrence per requested key, then rebuild from the survivors
+            survivors = []
+            j = 0
+            for key in self:
+                while j < len(order) and keys[order[j]] < key:
+                    j += 1
+                if j < len(order) and keys[order[j]] == key:
+                    deleted[order[j]] = True
+                    j += 1
+                else:
+                    survivors.append(key)
+            self.root = self.build_sorted(survivors)
+            return deleted
+
+        root = self.root
+        for i in order:
+            path, node = self.find_path(root, keys[i])
+            if node:
+                root = self.unlink(path, node)
+                deleted[i] = True
+        self.root = root
+        return deleted
+
+    def split(self, key):
+        # Move every key >= key into a new tree with the same options and return it. Cutting
+        # the tree is O(log n); the half with the smaller height is then walked to split the
+        # node and tombstone counts between the two trees.
+        lower, upper = self.split_root(self.root, key)
+        other = self.spawn()
+        if self.get_height(lower) <= self.get_height(upper):
+            nodes, tombstones = self.tally(lower)
+            other.node_count = self.node_count - nodes
+            other.tombstones = self.tombstones - tombstones
+        else:
+            other.node_count, other.tombstones = self.tally(upper)
+        self.node_count -= other.node_count
+        self.tombstones -= other.tombstones
+        self.root = lower
+        other.root = upper
+        return other
+
+    def join(self, key, other):
+        # Append key and every key of other, which must all be >= key >= every key of this
+        # tree. other is left empty. Nodes of a tree with the same node layout are relinked in
+        # O(log n), the keys of any other tree are copied first.
+        last = next(self.range(reverse=True), None)
+        first = next(iter(other), None)
+        if (last is not None and last > key) or (first is not None and first < key):
+            raise ValueError("join needs every key of this tree <= key <= every key of other")
+        if self.multiset and key in (last, first):
+            raise ValueError("join cannot store a key twice in multiset mode")
+        # Nodes that a persistent tree may share with its snapshots are never adopted
+        if (other.node_type is self.node_type and other.multiset == self.multiset
+                and other.order_stats == self.order_stats and not (self.persistent or other.persistent)):
+            right = other.root
+            self.node_count += other.node_count
+            self.tombstones += other.tombstones
+        else:
+            node_count, tombstones = self.node_count, self.tombstones
+            right = self.build_sorted(other)
+            self.node_count += node_count
+            self.tombstones = tombstones
+        other.root = None
+        other.node_count = other.tombstones = 0
+        other.forget_all()
+        self.node_count += 1
+        self.root = self.link(self.root, self.node_type(key, self.generation), right)
+
+    def spawn(self):
+        # Empty tree with the same options
+        tree = type(self)(order_stats=self.order_stats, persistent=self.persistent, multiset=self.multiset,
+                          tombstone_threshold=self.tombstone_threshold, search_cache=self.search_cache,
+                          finger_search=self.finger_search)
+        # Nodes moved across keep their generation, so they are only copied if a snapshot of
+        # this tree still shares them
+        tree.generation = self.generation
+        return tree
+
+    def tally(self, root):
+        # Number of nodes and of tombstones under root
+        nodes = tombstones = 0
+        stack = [root] if root else []
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            if not node.count:
+                tombstones += 1
+            for child in (node.left, node.right):
+                if child:
+                    stack.append(child)
+        return nodes, tombstones
+
+    def split_root(self, root, key):
+        # Cut a tree into two roots: the keys < key and the keys >= key. Every node on the
+        # search path is rejoined to the side it belongs to, O(log n) in total. The counts of
+        # the tree are left as they are, the caller keeps or discards the halves.
+        path = []
+        node = root
+        while node:
+            path.append(node)
+            node = node.left if key <= node.key else node.right
+        lower = upper = None
+        for node in reversed(path):
+            if key <= node.key:
+                upper = self.link(upper, node, node.right)
+            else:
+                lower = self.link(node.left, node, lower)
+        return lower, upper
+
+    def union(self, other):
+        # Add every key of another tree. A key found in both trees is stored once, except in
+        # multiset mode where the counts add up. Join-based divide and conquer, O(m log(n/m + 1))
+        # for trees of n and m keys once the keys of other are copied (other is left unchanged).
+        if self.tombstones:
+            self.root = self.purge(self.root)
+        # The copy of other is built as a tree of its own, which restarts the node count
+        node_count = self.node_count
+        copy = self.build_sorted(other)
+        self.node_count += node_count
+        self.root = self.unite(self.root, copy)
+
+    def intersection(self, other):
+        # Keep only the keys also found in other (in multiset mode the smaller count)
+        if self.tombstones:
+            self.root = self.purge(self.root)
+        copy = self.build_sorted(other)
+        # intersect counts the nodes it keeps
+        self.node_count = 0
+        self.root = self.intersect(self.root, copy)
+
+    def difference(self, other):
+        # Remove the keys found in other (in multiset mode as many occurrences as other holds)
+        if self.tombstones:
+            self.root = self.purge(self.root)
+        node_count = self.node_count
+        copy = self.build_sorted(other)
+        self.node_count = node_count
+        self.root = self.subtract(self.root, copy)
+
+    def delete_range(self, lo, hi):
+        # Remove every key in [lo, hi) with two splits and one join, and return how many there were
+        left, rest = self.split_root(self.root, lo)
+        middle, right = self.split_root(rest, hi)
+        removed = self.discard(middle)
+        self.root = self.concat(left, right)
+        return removed
+
+    def unite(self, a, b):
+        if not a:
+            return b
+        if not b:
+            return a
+        b_left, b_right = self.split_root(b, a.key)
+        match, b_right = self.take_first(b_right, a.key)
+        a_left, a_right = a.left, a.right
+        if match:
+            # The node of other is merged into a
+            self.node_count -= 1
+        if match and self.multiset:
+            if self.persistent:
+                a = self.writable(a)
+            a.count += match.count
+        return self.link(self.unite(a_left, b_left), a, self.unite(a_right, b_right))
+
+    def intersect(self, a, b):
+        if not a or not b:
             return None
-        if root.key == key:
-            return root
-        if key < root.key:
-            return self.search(root.left, key)
-        return self.search(root.right, key)
+        b_left, b_right = self.split_root(b, a.key)
+        match, b_right = self.take_first(b_right, a.key)
+        left = self.intersect(a.left, b_left)
+        right = self.intersect(a.right, b_right)
+        if not match:
+            return self.concat(left, right)
+        if match.count < a.count:
+            if self.persistent:
+                a = self.writable(a)
+            a.count = match.count
+        self.node_count += 1
+        return self.link(left, a, right)
+
+    def subtract(self, a, b):
+        if not a or not b:
+            return a
+        a_left, a_right = self.split_root(a, b.key)
+        match, a_right = self.take_first(a_right, b.key)
+        left = self.subtract(a_left, b.left)
+        right = self.subtract(a_right, b.right)
+        if match and match.count > b.count:
+            if self.persistent:
+                match = self.writable(match)
+            match.count -= b.count
+            return self.link(left, match, right)
+        if match:
+            self.node_count -= 1
+        return self.concat(left, right)
+
+    def discard(self, root):
+        # Drop a detached subtree from the node and tombstone counts, returns its occurrences
+        occurrences = 0
+        stack = [root] if root else []
+        while stack:
+            node = stack.pop()
+            self.node_count -= 1
+            if not node.count:
+                self.tombstones -= 1
+            occurrences += node.count
+            for child in (node.left, node.right):
+                if child:
+                    stack.append(child)
+        return occurrences
+
+    def link(self, left, node, right):
+        # Join two subtrees and a detached node between them (keys of left <= node.key <= keys
+        # of right): hang the node and the shorter subtree off the inner spine of the taller
+        # one at a subtree of about the same height, then retrace the spine
+        self.forget_all()
+        if self.persistent:
+            node = self.writable(node)
+        left_height = self.get_height(left)
+        right_height = self.get_height(right)
+        path = []
+        spine = None
+        if left_height > right_height + 1:
+            spine = left
+            while self.get_height(spine) > right_height + 1:
+                path.append(spine)
+                spine = spine.right
+            left = spine
+        elif right_height > left_height + 1:
+            spine = right
+            while self.get_height(spine) > left_height + 1:
+                path.append(spine)
+                spine = spine.left
+            right = spine
+        node.left = left
+        node.right = right
+        node.height = 1 + max(self.get_height(left), self.get_height(right))
+        if self.order_stats:
+            self.update_size(node)
+        if not path:
+            return node
+        if self.persistent:
+            path = self.copy_path(path)
+        return self.retrace(path, spine, node, self.get_size(node) - self.get_size(spine))
+
+    def concat(self, left, right):
+        # Join two subtrees without a middle key, borrowing the smallest node of right
+        if not left:
+            return right
+        if not right:
+            return left
+        node, right = self.pop_first(right)
+        return self.link(left, node, right)
+
+    def pop_first(self, root):
+        # Detach the smallest node of a tree, returns (node, remaining root)
+        path = []
+        node = root
+        while node.left:
+            path.append(node)
+            node = node.left
+        if self.persistent:
+            path = self.copy_path(path)
+        return node, self.retrace(path, node, node.right, -node.count)
+
+    def take_first(self, root, key):
+        # Detach the smallest node of a tree if it holds key, returns (node or None, root)
+        first = root
+        while first and first.left:
+            first = first.left
+        if not first or first.key != key:
+            return None, root
+        return self.pop_first(root)
+
+    def __iter__(self):
+        return self.range()
+
+    def range(self, lo=None, hi=None, reverse=False):
+        return self.walk(self.root, lo, hi, reverse)
+
+    def walk(self, root, lo=None, hi=None, reverse=False):
+        # Lazily yield the keys in [lo, hi) under root in order, skipping subtrees outside the
+        # bounds. Only the current root-to-node path is kept on the stack.
+        stack = []
+        node = root
+
+        if not reverse:
+            while True:
+                while node:
+                    if lo is not None and node.key < lo:
+                        node = node.right
+                    else:
+                        stack.append(node)
+                        node = node.left
+                if not stack:
+                    return
+                node = stack.pop()
+                if hi is not None and node.key >= hi:
+                    return
+                for _ in range(node.count):
+                    yield node.key
+                node = node.right
+        else:
+            while True:
+                while node:
+                    if hi is not None and node.key >= hi:
+                        node = node.left
+                    else:
+                        stack.append(node)
+                        node = node.right
+                if not stack:
+                    return
+                node = stack.pop()
+                if lo is not None and node.key < lo:
+                    return
+                for _ in range(node.count):
+                    yield node.key
+                node = node.left
+
+    def floor(self, key):
+        return self.below(key, True)
+
+    def ceiling(self, key):
+        return self.above(key, True)
+
+    def predecessor(self, key):
+        return self.below(key, False)
+
+    def successor(self, key):
+        return self.above(key, False)
+
+    def below(self, key, inclusive):
+        # Largest stored key < key (or <= key when inclusive), None if there is none
+        if self.tombstones:
+            # The best candidate of the descent may be dead, so walk back to the first live key
+            if inclusive and self.search(self.root, key):
+                return key
+            return next(self.range(hi=key, reverse=True), None)
+        best = None
+        node = self.root
+        while node:
+            if node.key < key or (inclusive and node.key == key):
+                best = node.key
+                node = node.right
+            else:
+                node = node.left
+        return best
+
+    def above(self, key, inclusive):
+        # Smallest stored key > key (or >= key when inclusive), None if there is none
+        if self.tombstones:
+            for stored in self.range(key):
+                if inclusive or stored != key:
+                    return stored
+            return None
+        best = None
+        node = self.root
+        while node:
+            if node.key > key or (inclusive and node.key == key):
+                best = node.key
+                node = node.left
+            else:
+                node = node.right
+        return best
+
+    def rank(self, key):
+        # Number of stored keys strictly less than key
+        self.require_order_stats()
+        rank = 0
+        node = self.root
+        while node:
+            if key <= node.key:
+                node = node.left
+            else:
+                rank += node.count + self.get_size(node.left)
+                node = node.right
+        return rank
+
+    def select(self, k):
+        # The k-th smallest key, counting from 0
+        self.require_order_stats()
+        if k < 0 or k >= self.get_size(self.root):
+            raise IndexError("select index out of range")
+        node = self.root
+        while True:
+            left_size = self.get_size(node.left)
+            if k < left_size:
+                node = node.left
+            elif k < left_size + node.count:
+                return node.key
+            else:
+                k -= left_size + node.count
+                node = node.right
+
+    def count_range(self, lo, hi):
+        # Number of stored keys in [lo, hi)
+        if hi <= lo:
+            return 0
+        return self.rank(hi) - self.rank(lo)
+
+    def require_order_stats(self):
+        if not self.order_stats:
+            raise ValueError("Order statistics are not enabled, create the tree with order_stats=True")
+
+    def get_size(self, node):
+        if not node:
+            return 0
+        return node.size
+
+    def update_size(self, node):
+        node.size = node.count + self.get_size(node.left) + self.get_size(node.right)
+
+    def memory_footprint(self):
+        # Exact bytes held by the nodes reachable from the root. Nodes are freed as soon as
+        # they are unlinked, so the only dead bytes are tombstones and there is no spare capacity.
+        live_bytes = 0
+        dead_bytes = 0
+        count = 0
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            count += node.count
+            if node.count:
+                live_bytes += sys.getsizeof(node) + sys.getsizeof(node.key)
+            else:
+                dead_bytes += sys.getsizeof(node) + sys.getsizeof(node.key)
+            if node.left:
+                stack.append(node.left)
+            if node.right:
+                stack.append(node.right)
+        overhead_bytes = sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+        total_bytes = live_bytes + dead_bytes + overhead_bytes
+        return {
+            "keys": count,
+            "live_bytes": live_bytes,
+            "dead_bytes": dead_bytes,
+            "spare_bytes": 0,
+            "overhead_bytes": overhead_bytes,
+            "total_bytes": total_bytes,
+            "bytes_per_key": total_bytes / count if count else 0.0,
+        }
 
     def get_height(self, node):
         if not node:
@@ -120,6 +967,9 @@ class AVLTreeReference:
         return self.get_height(node.left) - self.get_height(node.right)
 
     def left_rotate(self, z):
+        if self.persistent:
+            z = self.writable(z)
+            z.right = self.writable(z.right)
         y = z.right
         T2 = y.left
 
@@ -130,11 +980,17 @@ class AVLTreeReference:
         # Update heights
         z.height = 1 + max(self.get_height(z.left), self.get_height(z.right))
         y.height = 1 + max(self.get_height(y.left), self.get_height(y.right))
+        if self.order_stats:
+            self.update_size(z)
+            self.update_size(y)
 
         # Return the new root
         return y
 
     def right_rotate(self, z):
+        if self.persistent:
+            z = self.writable(z)
+            z.left = self.writable(z.left)
         y = z.left
         T3 = y.right
 
@@ -145,6 +1001,9 @@ class AVLTreeReference:
         # Update heights
         z.height = 1 + max(self.get_height(z.left), self.get_height(z.right))
         y.height = 1 + max(self.get_height(y.left), self.get_height(y.right))
+        if self.order_stats:
+            self.update_size(z)
+            self.update_size(y)
 
         # Return the new root
         return y
@@ -154,3 +1013,130 @@ class AVLTreeReference:
         while current.left:
             current = current.left
         return current
+
+
+class AVLTreeSnapshot(AVLTreeReference):
+    # Read-only view returned by AVLTreeReference.snapshot(), safe to traverse without locks
+    def __init__(self, root, order_stats=False, multiset=False, tombstone_threshold=None):
+        super().__init__(order_stats=order_stats, multiset=multiset, tombstone_threshold=tombstone_threshold)
+        self.root = root
+
+    def read_only(self, *args, **kwargs):
+        raise TypeError("Snapshots are read-only")
+
+    insert = delete = delete_all = unlink = bury = insert_many = delete_many = read_only
+    join = split = union = intersection = difference = delete_range = read_only
+
+
+class CountingAVLTreeReference(AVLTreeReference):
+    # Instrumented engine that tallies the work behind every operation in self.counters. All
+    # of the counting lives in these overrides, so a plain AVLTreeReference pays nothing for it.
+    # Comparisons and visited nodes come from tracing each descent the way the engine walks
+    # it; the climbs of finger search and the detours past tombstones are not traced.
+    COUNTERS = ("comparisons", "nodes_visited", "rotations_ll", "rotations_lr", "rotations_rr",
+                "rotations_rl", "retraces", "retrace_depth", "allocations")
+
+    def __init__(self, *args, **kwargs):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        super().__init__(*args, **kwargs)
+
+    def reset_counters(self):
+        # Zero every counter and return the tallies gathered so far
+        counters = self.counters
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        return counters
+
+    def height_stats(self):
+        # Height of the tree and the mean depth of its nodes (the root is at depth 1), which is
+        # the number of nodes a successful search visits on average
+        total_depth = 0
+        nodes = 0
+        stack = [(self.root, 1)] if self.root else []
+        while stack:
+            node, depth = stack.pop()
+            total_depth += depth
+            nodes += 1
+            for child in (node.left, node.right):
+                if child:
+                    stack.append((child, depth + 1))
+        return {
+            "max_height": self.get_height(self.root),
+            "average_height": total_depth / nodes if nodes else 0.0,
+        }
+
+    def trace(self, node, key, stop):
+        # Count the descent for key: one equality test per node, plus an ordering test at each
+        # node the walk passes through. Stops at an equal key only where stop(node) says the
+        # engine does.
+        counters = self.counters
+        while node:
+            counters["nodes_visited"] += 1
+            counters["comparisons"] += 1
+            if node.key == key and stop(node):
+                return node
+            counters["comparisons"] += 1
+            node = node.left if key < node.key else node.right
+        return None
+
+    def lookup(self, root, key):
+        if not self.finger_search and self.tombstone_threshold is None:
+            self.trace(root, key, lambda node: True)
+        return super().lookup(root, key)
+
+    def find_path(self, root, key):
+        if self.tombstone_threshold is None:
+            self.trace(root, key, lambda node: True)
+        return super().find_path(root, key)
+
+    def find_live_path(self, root, key):
+        self.trace(root, key, lambda node: node.count > 0)
+        return super().find_live_path(root, key)
+
+    def insert(self, root, key):
+        if not self.trace(root, key, lambda node: self.multiset or not node.count):
+            self.counters["allocations"] += 1
+            if root:
+                # Linking the new node to its parent compares against the parent once more
+                self.counters["comparisons"] += 1
+        return super().insert(root, key)
+
+    def unlink(self, path, node, remove_all=False):
+        if (self.tombstone_threshold is None and node.left and node.right
+                and (not self.multiset or node.count <= 1 or remove_all)):
+            # Walk down to the inorder successor that gets unlinked instead
+            successor = node.right
+            self.counters["nodes_visited"] += 1
+            while successor.left:
+                successor = successor.left
+                self.counters["nodes_visited"] += 1
+        return super().unlink(path, node, remove_all)
+
+    def retrace(self, path, old_child, child, delta):
+        self.counters["retraces"] += 1
+        return super().retrace(path, old_child, child, delta)
+
+    def rebalance(self, node):
+        # Every level a retrace climbs is one rebalance call
+        counters = self.counters
+        counters["retrace_depth"] += 1
+        balance = self.get_balance(node)
+        if balance > 1:
+            counters["rotations_ll" if self.get_balance(node.left) >= 0 else "rotations_lr"] += 1
+        elif balance < -1:
+            counters["rotations_rr" if self.get_balance(node.right) <= 0 else "rotations_rl"] += 1
+        return super().rebalance(node)
+
+    def build_balanced(self, keys, lo, hi, counts=None):
+        if lo < hi:
+            self.counters["allocations"] += 1
+        return super().build_balanced(keys, lo, hi, counts)
+
+    def writable(self, node):
+        if node.generation != self.generation:
+            # Copy on write of a node shared with a snapshot
+            self.counters["allocations"] += 1
+        return super().writable(node)
+
+    def join(self, key, other):
+        self.counters["allocations"] += 1
+        return super().join(key, other)
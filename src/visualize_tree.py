@@ -1,85 +1,257 @@
-# import graphviz
-# import os
-# import subprocess
-
-# def visualize_tree(tree, tree_type="Reference", operation="Visualization"):
-#     """
-#     Visualize the AVL tree using Graphviz, with labels for operation and tree type.
-#     """
-#     dot = graphviz.Digraph(comment='AVL Tree', format='png')
-
-#     # Add a title to the graph with operation (insert, delete, search) and tree type
-#     dot.attr(label=f"AVL Tree - {tree_type} | Operation: {operation}", labelloc="t", fontsize="20")
-
-#     if tree_type == "Reference":
-#         # Handle reference-based AVL tree visualization
-#         def add_edges(node, parent=None):
-#             if node is not None:
-#                 node_id = str(node.key)
-#                 dot.node(node_id, label=str(node.key))
-
-#                 if parent:
-#                     dot.edge(parent, node_id)  # Add edge from parent to current node
-
-#                 add_edges(node.left, parent=node_id)
-#                 add_edges(node.right, parent=node_id)
-
-#         add_edges(tree.root)  # Start visualizing from the root
-
-#     elif tree_type == "Array":
-#         # Handle array-based AVL tree visualization
-#         def add_edges_from_array(array, pos_x=0, parent=None):
-#             """
-#             Recursively add edges based on the array representation of the AVL tree.
-#             `array` is the list representing the tree.
-#             `parent` is the parent node for connecting edges.
-#             """
-#             if pos_x >= len(array) or array[pos_x] is None:
-#                 return
-#             node_id = str(array[pos_x])
-#             dot.node(node_id, label=str(array[pos_x]))
-
-#             if parent:
-#                 dot.edge(parent, node_id)  # Add edge from parent to current node
-
-#             # Left and right children in the array
-#             left_pos_x = 2 * pos_x + 1
-#             right_pos_x = 2 * pos_x + 2
-#             add_edges_from_array(array, pos_x=left_pos_x, parent=node_id)
-#             add_edges_from_array(array, pos_x=right_pos_x, parent=node_id)
-
-#         add_edges_from_array(tree.tree)  # Make sure you're using `tree.tree` if that is how you're storing it
-
-#     # Ensure the output directory exists
-#     output_dir = r"C:\Users\brike\Desktop\Algoritma\visual"
-#     os.makedirs(output_dir, exist_ok=True)
-
-#     # Generate a unique filename with tree type, operation, and database size
-#     output_path = get_unique_filename(output_dir, tree_type, operation, ".png")
-
-#     # Render the visualization to the specified file path (without the extension, as Graphviz will append '.png')
-#     render_with_timeout(dot, output_path)
-
-
-# def get_unique_filename(folder, tree_type, operation, extension):
-#     """
-#     Generate a unique filename in the specified folder with tree type, operation, and database size.
-#     """
-#     counter = 1
-#     while True:
-#         filename = f"{tree_type}_{operation}_{counter}{extension}"
-#         full_path = os.path.join(folder, filename)
-#         if not os.path.exists(full_path):
-#             return full_path
-#         counter += 1
-
-
-# def render_with_timeout(dot, output_path, timeout=60):
-#     try:
-#         # Render using Graphviz
-#         dot.render(output_path[:-4], format='png', cleanup=True)
-#         print(f"Tree visualization saved at {output_path}")
-#     except subprocess.TimeoutExpired:
-#         print("Rendering timed out.")
-#     except subprocess.CalledProcessError as e:
-#         print(f"Error in rendering: {e}")
\ No newline at end of file
+import hashlib
+import os
+import subprocess
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from reference_avl_tree import AVLTreeReference
+from array_avl_tree import ArrayAVLTree
+from bplus_tree import BPlusTree
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "visual")
+
+# Keys shown in a B+tree node label before the middle ones are elided
+LABEL_KEYS = 6
+
+
+def _reference_view(tree):
+    def children(node):
+        return [child for child in (node.left, node.right) if child is not None]
+
+    def describe(node):
+        return f"{node.size} nodes" if tree.order_stats else f"height {node.height}"
+
+    def path_to(key):
+        path = []
+        node = tree.root
+        while node is not None:
+            path.append(node)
+            if key == node.key:
+                break
+            node = node.left if key < node.key else node.right
+        return path
+
+    return tree.root, children, lambda node: str(node.key), describe, path_to
+
+
+def _array_view(tree):
+    keys, left, right = tree.keys, tree.left, tree.right
+
+    def children(node):
+        return [child for child in (left[node], right[node]) if child != -1]
+
+    def describe(node):
+        return f"{tree.sizes[node]} nodes" if tree.sizes is not None else f"height {tree.heights[node]}"
+
+    def path_to(key):
+        path = []
+        node = tree.root
+        while node != -1:
+            path.append(node)
+            if key == keys[node]:
+                break
+            node = left[node] if key < keys[node] else right[node]
+        return path
+
+    root = tree.root if tree.root != -1 else None
+    return root, children, lambda node: str(keys[node]), describe, path_to
+
+
+def _bplus_view(tree):
+    keys, child_ids = tree.keys, tree.children
+
+    def children(node):
+        return list(child_ids[node] or ())
+
+    def label(node):
+        node_keys = keys[node]
+        if len(node_keys) <= LABEL_KEYS:
+            return " | ".join(map(str, node_keys))
+        half = LABEL_KEYS // 2
+        return " | ".join([*map(str, node_keys[:half]), "...", *map(str, node_keys[-half:])])
+
+    def describe(node):
+        if child_ids[node] is None:
+            return f"leaf of {len(keys[node])} keys"
+        return f"{len(child_ids[node])} children"
+
+    def path_to(key):
+        path = [tree.root]
+        node = tree.root
+        while child_ids[node] is not None:
+            node = child_ids[node][bisect_left(keys[node], key)]
+            path.append(node)
+        return path
+
+    root = tree.root if len(tree) else None
+    return root, children, label, describe, path_to
+
+
+def tree_view(tree):
+    """
+    Engine-independent view of a tree for drawing: the root handle (None when empty) and
+    functions giving the children, the label and a one-line summary of a node, and the
+    nodes on the search path of a key.
+    """
+    if isinstance(tree, AVLTreeReference):
+        return _reference_view(tree)
+    if isinstance(tree, ArrayAVLTree):
+        return _array_view(tree)
+    if isinstance(tree, BPlusTree):
+        return _bplus_view(tree)
+    raise ValueError(f"Cannot visualize {type(tree).__name__}")
+
+
+def build_dot(tree, title, search_key=None, max_depth=8, max_nodes=255):
+    """
+    Graphviz DOT source of the top of a tree, walked breadth-first so the node budget is
+    spent level by level. At most max_nodes nodes down to depth max_depth - 1 are drawn;
+    the children of a node that would go past either limit are replaced by a single dashed
+    box summarizing them. The search path of search_key, if given, is highlighted.
+
+    Returns (source, shape_hash), where shape_hash identifies the drawn shape, labels and
+    highlighting, but not the title.
+    """
+    root, children, label, describe, path_to = tree_view(tree)
+    path = set(path_to(search_key)) if search_key is not None and root is not None else set()
+
+    lines = []
+    queue = deque()
+    if root is not None:
+        queue.append((root, 0, None))
+    drawn = 0
+    while queue:
+        node, depth, parent_id = queue.popleft()
+        node_id = f"n{drawn}"
+        drawn += 1
+
+        text = label(node).replace('"', '\\"')
+        if node in path:
+            lines.append(f'{node_id} [label="{text}", color=red, style=filled, fillcolor=lightpink];')
+        else:
+            lines.append(f'{node_id} [label="{text}"];')
+        if parent_id is not None:
+            # The search path runs from the root, so a node on it is reached by a path edge
+            style = ' [color=red, penwidth="2.0"]' if node in path else ""
+            lines.append(f"{parent_id} -> {node_id}{style};")
+
+        node_children = children(node)
+        if not node_children:
+            continue
+        if depth + 1 < max_depth and drawn + len(queue) + len(node_children) <= max_nodes:
+            for child in node_children:
+                queue.append((child, depth + 1, node_id))
+        else:
+            # Out of depth or node budget: one box stands in for all the children
+            if len(node_children) <= 2:
+                summary = ", ".join(map(describe, node_children))
+            else:
+                summary = f"{len(node_children)} subtrees"
+            lines.append(f'{node_id}_rest [label="... {summary}", shape=box, style=dashed];')
+            lines.append(f"{node_id} -> {node_id}_rest [style=dashed];")
+
+    body = "\n".join(lines)
+    shape_hash = hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+    source = (f'digraph {{\nlabel="{title}";\nlabelloc="t";\nfontsize="20";\n'
+              f'node [shape=ellipse];\n{body}\n}}\n')
+    return source, shape_hash
+
+
+def get_unique_filename(folder, tree_type, operation, extension):
+    """
+    Generate a unique filename in the specified folder with tree type, operation, and database size.
+    """
+    counter = 1
+    while True:
+        filename = f"{tree_type}_{operation}_{counter}{extension}"
+        full_path = os.path.join(folder, filename)
+        if not os.path.exists(full_path):
+            return full_path
+        counter += 1
+
+
+def render_dot(dot_path, image_format="png", timeout=60):
+    """
+    Render a DOT file next to itself with the Graphviz `dot` executable. Returns the image
+    path, or None if rendering failed (the DOT file is kept either way).
+    """
+    output_path = f"{os.path.splitext(dot_path)[0]}.{image_format}"
+    try:
+        subprocess.run(["dot", f"-T{image_format}", dot_path, "-o", output_path],
+                       check=True, timeout=timeout, capture_output=True)
+    except FileNotFoundError:
+        print(f"Graphviz 'dot' executable not found, kept {dot_path}")
+        return None
+    except subprocess.TimeoutExpired:
+        print("Rendering timed out.")
+        return None
+    except subprocess.CalledProcessError as e:
+        print(f"Error in rendering: {e}")
+        return None
+    print(f"Tree visualization saved at {output_path}")
+    return output_path
+
+
+class Visualizer:
+    """
+    Bounded, asynchronous tree snapshots. submit() walks at most max_nodes nodes and
+    writes the DOT file right away, so the tree can change as soon as it returns; the
+    Graphviz render then runs on a background thread pool (the work happens in the `dot`
+    process, so threads are enough). image_format="dot" keeps only the DOT files.
+
+    A snapshot whose drawing is identical to one already written for the same tree type
+    is skipped.
+    """
+    def __init__(self, output_dir=DEFAULT_OUTPUT_DIR, image_format="png", workers=2,
+                 max_depth=8, max_nodes=255, timeout=60):
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=workers) if image_format != "dot" else None
+        self.futures = []
+        self.seen = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, tree, tree_type, operation="Visualization", search_key=None):
+        """
+        Snapshot a tree. Returns the DOT file path, or None if the snapshot was skipped.
+        """
+        source, shape_hash = build_dot(tree, f"{tree_type} | Operation: {operation}", search_key,
+                                       self.max_depth, self.max_nodes)
+        if (tree_type, shape_hash) in self.seen:
+            return None
+        self.seen.add((tree_type, shape_hash))
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        dot_path = get_unique_filename(self.output_dir, tree_type, operation, ".dot")
+        with open(dot_path, "w") as f:
+            f.write(source)
+        if self.pool is not None:
+            self.futures.append(self.pool.submit(render_dot, dot_path, self.image_format, self.timeout))
+        return dot_path
+
+    def close(self):
+        """
+        Wait for the pending renders and return the paths of the images produced.
+        """
+        images = [future.result() for future in self.futures]
+        self.futures = []
+        if self.pool is not None:
+            self.pool.shutdown()
+        return [image for image in images if image is not None]
+
+
+def visualize_tree(tree, tree_type="Reference", operation="Visualization", search_key=None,
+                   output_dir=DEFAULT_OUTPUT_DIR, image_format="png"):
+    """
+    One-off snapshot of a tree, rendered before returning.
+    """
+    with Visualizer(output_dir, image_format, workers=1) as visualizer:
+        return visualizer.submit(tree, tree_type, operation, search_key)
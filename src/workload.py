@@ -0,0 +1,244 @@
+import argparse
+import gzip
+import random
+import time
+from collections import deque
+from concurrent_tree import tree_insert, tree_delete, tree_search
+
+# One trace line per operation: "<opcode> <key>" or "r <lo> <hi>" for a range scan of [lo, hi)
+OPCODES = {"i": "insert", "s": "search", "d": "delete", "r": "range"}
+OPERATION_CODES = {operation: code for code, operation in OPCODES.items()}
+
+# Operation ratios of the standard mixes, modelled on the YCSB core workloads. YCSB updates
+# become inserts here since the engines store bare keys.
+MIXES = {
+    "A": {"search": 0.5, "insert": 0.5},      # update heavy
+    "B": {"search": 0.95, "insert": 0.05},    # read mostly
+    "C": {"search": 1.0},                     # read only
+    "E": {"range": 0.95, "insert": 0.05},     # short range scans
+    "churn": {"insert": 0.5, "delete": 0.5},  # keys come and go, the tree size stays flat
+}
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of latencies in nanoseconds. Values below
+    2 ** sub_bucket_bits are counted exactly; above that every power-of-two range is split
+    into 2 ** (sub_bucket_bits - 1) equal buckets, so any recorded value is reported within
+    a relative error of 2 ** (1 - sub_bucket_bits) (under 1.6% by default) while the memory
+    stays logarithmic in the largest value.
+    """
+    def __init__(self, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.counts = [0] * self.sub_bucket_count
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def __len__(self):
+        return self.total
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def _highest_value(self, index):
+        # Largest value that falls into the bucket at `index`
+        if index < self.sub_bucket_count:
+            return index
+        shift, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        shift += 1
+        return ((offset + self.half_count + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        index = self._index(value)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += count
+        self.total += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("Cannot merge histograms with different precision")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def percentile(self, percent):
+        """
+        Smallest recorded latency (up to the bucket precision) that `percent` percent of
+        all recorded latencies do not exceed.
+        """
+        if not self.total:
+            return 0
+        target = max(int(percent / 100 * self.total + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Count, min, mean, max and the standard percentiles, in nanoseconds.
+        """
+        summary = {"count": self.total, "min": self.min or 0, "mean": self.mean(), "max": self.max}
+        for percent in PERCENTILES:
+            summary[f"p{percent:g}".replace(".", "")] = self.percentile(percent)
+        return summary
+
+
+def generate_operations(count, mix="B", key_space=100000, seed=0, range_length=100):
+    """
+    Lazily yield `count` (operation, key, hi) tuples drawn from a mix, either the name of
+    one of MIXES or a dict of operation ratios. Keys are uniform over [0, key_space);
+    range scans cover [key, key + range_length), other operations have hi None.
+    """
+    ratios = MIXES[mix] if isinstance(mix, str) else mix
+    unknown = set(ratios) - set(OPERATION_CODES)
+    if unknown:
+        raise ValueError(f"Unknown operations in mix: {sorted(unknown)}")
+    operations = list(ratios)
+    weights = [ratios[operation] for operation in operations]
+
+    rng = random.Random(seed)
+    for _ in range(count):
+        operation = rng.choices(operations, weights)[0]
+        key = rng.randrange(key_space)
+        yield operation, key, key + range_length if operation == "range" else None
+
+
+def _open_text(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def write_trace(path, operations):
+    """
+    Stream (operation, key, hi) tuples to a trace file, gzip-compressed if the path ends in .gz.
+    """
+    with _open_text(path, "w") as f:
+        for operation, key, hi in operations:
+            code = OPERATION_CODES[operation]
+            f.write(f"{code} {key} {hi}\n" if operation == "range" else f"{code} {key}\n")
+
+
+def read_trace(path):
+    """
+    Lazily yield the (operation, key, hi) tuples of a trace file, so a trace never has to
+    fit in memory. Blank lines and lines starting with '#' are skipped.
+    """
+    with _open_text(path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            operation = OPCODES.get(fields[0])
+            if operation is None or len(fields) != (3 if operation == "range" else 2):
+                raise ValueError(f"{path}:{line_number}: malformed trace line {line.rstrip()!r}")
+            yield operation, int(fields[1]), int(fields[2]) if operation == "range" else None
+
+
+def replay(tree, operations, interval=1.0):
+    """
+    Apply a stream of (operation, key, hi) tuples to any engine one at a time, recording the
+    latency of each operation with perf_counter_ns. Range scans are timed until the last
+    key in range has been produced.
+
+    Returns a dict with the number of operations, the elapsed seconds and overall
+    throughput, a LatencyHistogram per operation plus one for all operations ("all"), and
+    the throughput timeline as (seconds since start, operations per second) for every
+    `interval` seconds of the run.
+    """
+    def scan(tree, lo, hi):
+        deque(tree.range(lo, hi), maxlen=0)
+
+    handlers = {"insert": tree_insert, "search": tree_search, "delete": tree_delete}
+    histograms = {"all": LatencyHistogram()}
+    timeline = []
+    perf_counter_ns = time.perf_counter_ns
+    interval_ns = int(interval * 1e9)
+
+    count = 0
+    window_count = 0
+    start = window_start = perf_counter_ns()
+    for operation, key, hi in operations:
+        histogram = histograms.get(operation)
+        if histogram is None:
+            histogram = histograms[operation] = LatencyHistogram()
+
+        if operation == "range":
+            op_start = perf_counter_ns()
+            scan(tree, key, hi)
+            op_end = perf_counter_ns()
+        else:
+            handler = handlers[operation]
+            op_start = perf_counter_ns()
+            handler(tree, key)
+            op_end = perf_counter_ns()
+
+        histogram.record(op_end - op_start)
+        count += 1
+        window_count += 1
+        if op_end - window_start >= interval_ns:
+            timeline.append(((op_end - start) / 1e9, window_count * 1e9 / (op_end - window_start)))
+            window_count = 0
+            window_start = op_end
+
+    end = perf_counter_ns()
+    elapsed = end - start
+    if window_count:
+        timeline.append((elapsed / 1e9, window_count * 1e9 / max(end - window_start, 1)))
+    for name, histogram in histograms.items():
+        if name != "all":
+            histograms["all"].merge(histogram)
+
+    return {
+        "operations": count,
+        "elapsed": elapsed / 1e9,
+        "throughput": count / (elapsed / 1e9) if elapsed else 0.0,
+        "latency": histograms,
+        "timeline": timeline,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a mixed-operation workload trace.")
+    parser.add_argument("output", help="trace file to write (gzip-compressed if it ends in .gz)")
+    parser.add_argument("--operations", type=int, default=100000, help="number of operations")
+    parser.add_argument("--mix", choices=list(MIXES), default="B")
+    parser.add_argument("--key-space", type=int, default=100000, help="keys fall in [0, key-space)")
+    parser.add_argument("--range-length", type=int, default=100, help="key span of each range scan")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_trace(args.output, generate_operations(args.operations, args.mix, args.key_space,
+                                                 args.seed, args.range_length))
+    print(f"Wrote {args.operations} operations of mix {args.mix} to {args.output}")